@@ -29,6 +29,109 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = env.str('SECRET_KEY')
 TG_TOKEN = env.str('TG_TOKEN')
+# Адрес Bot API, например фейкового сервера для нагрузочного теста
+TG_API_URL = env.str('TG_API_URL', default=None)
+
+# Число потоков, обрабатывающих апдейты, и предел очереди апдейтов.
+# При переполнении апдейты неприоритетных состояний отбрасываются.
+# При остановке бот дообрабатывает очередь не дольше BOT_STOP_TIMEOUT секунд
+BOT_WORKERS = env.int('BOT_WORKERS', default=4)
+BOT_UPDATE_QUEUE_SIZE = env.int('BOT_UPDATE_QUEUE_SIZE', default=1000)
+BOT_STOP_TIMEOUT = env.float('BOT_STOP_TIMEOUT', default=30)
+
+# Ограничение частоты апдейтов одного чата: апдейтов в секунду,
+# допустимая пачка подряд и окно для повторных нажатий той же кнопки.
+# 0 в THROTTLE_RATE - ограничение выключено
+THROTTLE_RATE = env.float('THROTTLE_RATE', default=2.0)
+THROTTLE_BURST = env.int('THROTTLE_BURST', default=10)
+THROTTLE_DUPLICATE_WINDOW = env.float(
+    'THROTTLE_DUPLICATE_WINDOW',
+    default=0.5
+)
+
+# Раз в столько секунд бот пишет в лог счетчики очереди и ограничений,
+# 0 - не писать
+BOT_STATS_INTERVAL = env.int('BOT_STATS_INTERVAL', default=60)
+
+# Уровень логов бота и доля отладочных записей, которые попадают в вывод
+LOG_LEVEL = env.str('LOG_LEVEL', default='INFO')
+LOG_DEBUG_SAMPLE_RATE = env.float('LOG_DEBUG_SAMPLE_RATE', default=1.0)
+
+# Апдейты, обработка которых дольше порога, профилируются и сохраняются
+# в каталог. 0 - профилирование выключено
+SLOW_UPDATE_THRESHOLD_MS = env.int('SLOW_UPDATE_THRESHOLD_MS', default=0)
+SLOW_UPDATE_PROFILE_DIR = env.str(
+    'SLOW_UPDATE_PROFILE_DIR',
+    default=str(BASE_DIR / 'slow_updates')
+)
+SLOW_UPDATE_PROFILES_KEEP = env.int('SLOW_UPDATE_PROFILES_KEEP', default=100)
+
+# Брошенные черновики тортов и заказов старше этого возраста удаляются.
+# Интервал в секундах включает фоновую очистку внутри runbot, 0 - выключена
+DRAFTS_MAX_AGE_HOURS = env.int('DRAFTS_MAX_AGE_HOURS', default=24)
+DRAFTS_SWEEP_INTERVAL = env.int('DRAFTS_SWEEP_INTERVAL', default=0)
+
+# Слоты доставки предлагаются на столько дней вперед, список слотов на день
+# кешируется на заданное число секунд
+DELIVERY_SLOT_DAYS = env.int('DELIVERY_SLOT_DAYS', default=7)
+DELIVERY_SLOTS_CACHE_SECONDS = env.int(
+    'DELIVERY_SLOTS_CACHE_SECONDS',
+    default=30
+)
+
+
+# Подбор торта по бюджету: сколько вариантов предлагать и как долго
+# кешировать популярность параметров
+BUDGET_SUGGESTIONS_COUNT = env.int('BUDGET_SUGGESTIONS_COUNT', default=5)
+OPTION_POPULARITY_CACHE_SECONDS = env.int(
+    'OPTION_POPULARITY_CACHE_SECONDS',
+    default=3600
+)
+
+# Матрица совместных выборов параметров обновляется с каждым заказанным
+# тортом и раз в заданное число секунд пересобирается из базы, 0 - никогда
+COOCCURRENCE_REBUILD_SECONDS = env.int(
+    'COOCCURRENCE_REBUILD_SECONDS',
+    default=24 * 60 * 60
+)
+
+# Защита от повторной доставки апдейтов: сколько последних апдейтов
+# и действий помнить в памяти, как часто сохранять обработанные апдейты
+# в базу и сколько часов их там хранить
+IDEMPOTENCY_CACHE_SIZE = env.int('IDEMPOTENCY_CACHE_SIZE', default=10000)
+IDEMPOTENCY_FLUSH_INTERVAL = env.int('IDEMPOTENCY_FLUSH_INTERVAL', default=5)
+IDEMPOTENCY_RETENTION_HOURS = env.int(
+    'IDEMPOTENCY_RETENTION_HOURS',
+    default=48
+)
+
+# Рассылка: сообщений в секунду на всех (Телеграм допускает около 30)
+# и число потоков отправки
+BROADCAST_RATE = env.float('BROADCAST_RATE', default=25.0)
+BROADCAST_WORKERS = env.int('BROADCAST_WORKERS', default=8)
+
+# Разговор, в котором пользователь молчит дольше CONVERSATION_IDLE_TIMEOUT
+# секунд, завершается, а его недособранный торт удаляется. Проверка идет
+# раз в CONVERSATION_EXPIRE_INTERVAL секунд, сверх MAX_CONVERSATIONS
+# сразу завершаются самые давние разговоры
+CONVERSATION_IDLE_TIMEOUT = env.int('CONVERSATION_IDLE_TIMEOUT', default=3600)
+CONVERSATION_EXPIRE_INTERVAL = env.int(
+    'CONVERSATION_EXPIRE_INTERVAL',
+    default=60
+)
+MAX_CONVERSATIONS = env.int('MAX_CONVERSATIONS', default=50000)
+
+# Превью торта: число процессов рендера (0 - превью не отправляются),
+# папка с готовыми картинками, размер стороны в пикселях, шрифт надписи
+# и предел числа превью и слоев в папке
+CAKE_PREVIEW_WORKERS = env.int('CAKE_PREVIEW_WORKERS', default=2)
+CAKE_PREVIEW_DIR = env.str(
+    'CAKE_PREVIEW_DIR',
+    default=str(BASE_DIR / 'cake_previews')
+)
+CAKE_PREVIEW_SIZE = env.int('CAKE_PREVIEW_SIZE', default=512)
+CAKE_PREVIEW_FONT = env.str('CAKE_PREVIEW_FONT', default='DejaVuSans.ttf')
+CAKE_PREVIEW_CACHE_SIZE = env.int('CAKE_PREVIEW_CACHE_SIZE', default=10000)
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = env.bool('DEBUG', default=True)
@@ -92,6 +195,33 @@ DATABASES = {
 db_from_env = dj_database_url.config()
 DATABASES['default'].update(db_from_env)
 
+# Реплики только для чтения, например
+# DATABASE_REPLICA_URLS=sqlite:////tmp/replica.sqlite3,postgres://...
+DATABASE_REPLICAS = []
+for replica_number, replica_url in enumerate(
+    env.list('DATABASE_REPLICA_URLS', default=[]),
+    start=1
+):
+    replica_alias = f'replica_{replica_number}'
+    DATABASES[replica_alias] = dj_database_url.parse(replica_url)
+    DATABASES[replica_alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(replica_alias)
+
+DATABASE_ROUTERS = ['bake_cake_bot.routers.ReplicaRouter']
+# Сколько секунд после записи чтения диалога идут в основную базу
+REPLICA_PIN_SECONDS = env.float('REPLICA_PIN_SECONDS', default=10)
+
+# Настройки SQLite для бота и админки, работающих с одной базой
+SQLITE_TUNING = env.bool('SQLITE_TUNING', default=True)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': env.int('SQLITE_BUSY_TIMEOUT', default=5000),
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -131,6 +261,18 @@ USE_TZ = True
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 STATIC_URL = '/static/'
 
+# Загруженные в админке слои картинок тортов. Бот читает их через то же
+# хранилище, поэтому оно должно быть общим для бота и админки.
+# SERVE_MEDIA - отдавать файлы из MEDIA_ROOT самим Django. Это
+# для разработки, в проде их отдает веб-сервер или внешнее хранилище
+DEFAULT_FILE_STORAGE = env.str(
+    'DEFAULT_FILE_STORAGE',
+    default='django.core.files.storage.FileSystemStorage'
+)
+MEDIA_ROOT = env.str('MEDIA_ROOT', default=os.path.join(BASE_DIR, 'media'))
+MEDIA_URL = '/media/'
+SERVE_MEDIA = env.bool('SERVE_MEDIA', default=DEBUG)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -13,9 +13,22 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
+from django.views.static import serve
 
 urlpatterns = [
     path('admin/', admin.site.urls),
 ]
+
+# static() работает только при DEBUG, а слои картинок нужны админке
+# и без него
+if settings.SERVE_MEDIA:
+    urlpatterns.append(
+        re_path(
+            rf'^{settings.MEDIA_URL.lstrip("/")}(?P<path>.*)$',
+            serve,
+            {'document_root': settings.MEDIA_ROOT},
+        )
+    )
@@ -1,11 +1,30 @@
+from datetime import timedelta
+
 from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
 
-from .models import Cake, Client, Category, Option, Order
+from .changelists import LargeTableAdminMixin
+from .models import ArchivedCake, ArchivedCakeOption, ArchivedOrder
+from .models import Broadcast
+from .models import Cake, CakeOption, Client, Category, DeliverySlot
+from .models import DailySales, Option, Order
+from .production import get_order_plan_counts, get_production_plan
+from .production import replace_order_plan
+from .sales import apply_order_sales, get_order_sales, get_sales_dashboard
+from .routers import ReplicaChangeListMixin
 
 
-class ClientAdmin(admin.ModelAdmin):
+class ClientAdmin(LargeTableAdminMixin, ReplicaChangeListMixin,
+                  admin.ModelAdmin):
     list_display = ['tg_chat_id', 'first_name', 'last_name', 'phone',
-                    'pd_proccessing_consent', 'address']
+                    'pd_proccessing_consent', 'address', 'orders_count',
+                    'lifetime_amount', 'last_order_at']
+    readonly_fields = ['orders_count', 'lifetime_amount', 'last_order_at']
+    # Поиск по началу значения, по каждому полю есть индекс
+    search_fields = ['phone', 'first_name', 'last_name', '=tg_chat_id']
+    ordering = ['id']
 
 
 class CategoryAdmin(admin.ModelAdmin):
@@ -15,17 +34,217 @@ class CategoryAdmin(admin.ModelAdmin):
 class OptionAdmin(admin.ModelAdmin):
     list_display = ['name', 'category', 'price']
     list_filter = ['category']
+    list_select_related = ['category']
+    search_fields = ['name']
+
 
+class CakeOptionInline(admin.TabularInline):
+    model = CakeOption
+    extra = 0
+    autocomplete_fields = ['option']
 
-class CakeAdmin(admin.ModelAdmin):
-    list_display = ['created_by', 'is_in_order', 'price']
+
+class CakeAdmin(LargeTableAdminMixin, ReplicaChangeListMixin,
+                admin.ModelAdmin):
+    list_display = ['id', 'created_by', 'is_in_order', 'price']
+    list_select_related = ['created_by']
     readonly_fields = ['price']
+    autocomplete_fields = ['created_by']
+    search_fields = ['=id', 'created_by__phone']
+    inlines = [CakeOptionInline]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        cake = form.instance
+        cake.recalculate_price()
+        cake.save(update_fields=['price'])
+        # Кеш состава заказа привязан к дате изменения заказа. update, а не
+        # save: статус и сумма заказов не меняются
+        Order.objects.filter(cakes=cake).update(modified_at=timezone.now())
 
 
-class OrderAdmin(admin.ModelAdmin):
-    readonly_fields = ['created_at', 'modified_at']
-    list_display = ['client', 'created_at', 'total_amount', 'status']
+class OrderAdmin(LargeTableAdminMixin, ReplicaChangeListMixin,
+                 admin.ModelAdmin):
+    # Слот меняется только через бронирование, иначе разойдется счетчик мест
+    readonly_fields = ['created_at', 'modified_at', 'delivery_slot']
+    list_display = [
+        'id',
+        'client',
+        'created_at',
+        'total_amount',
+        'status',
+        'delivery_slot',
+    ]
     list_filter = ['status']
+    list_select_related = ['client', 'delivery_slot']
+    date_hierarchy = 'created_at'
+    autocomplete_fields = ['client']
+    # Торты выбираются по номерам, а не списком всех тортов из базы
+    raw_id_fields = ['cakes']
+    search_fields = ['=id', 'client__phone', 'client__first_name',
+                     'client__last_name']
+
+    change_list_template = 'admin/bake_cake_bot/order/change_list.html'
+
+    def get_urls(self):
+        urls = [
+            path(
+                'production-plan/',
+                self.admin_site.admin_view(self.production_plan_view),
+                name='bake_cake_bot_order_production_plan',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def production_plan_view(self, request):
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'План производства',
+            'plan': get_production_plan(),
+        }
+        return TemplateResponse(
+            request,
+            'admin/bake_cake_bot/order/production_plan.html',
+            context
+        )
+
+    def save_model(self, request, obj, form, change):
+        # Торты формы сохраняются после заказа, поэтому план производства
+        # и сводки продаж пересчитываются в save_related, когда они
+        # уже записаны
+        obj._track_related_later = True
+        loaded_status = getattr(obj, '_loaded_status', None)
+        obj._plan_before = get_order_plan_counts(obj.pk, loaded_status)
+        obj._sales_before = get_order_sales(
+            obj.pk,
+            loaded_status,
+            getattr(obj, '_loaded_total_amount', None),
+            obj.created_at
+        )
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        order = form.instance
+        order.recalculate_total_amount()
+        order.save(update_fields=['total_amount'])
+        replace_order_plan(
+            order._plan_before,
+            get_order_plan_counts(order.pk, order.status)
+        )
+        apply_order_sales(order._sales_before, -1)
+        apply_order_sales(
+            get_order_sales(
+                order.pk,
+                order.status,
+                order.total_amount,
+                order.created_at
+            ),
+            1
+        )
+        order._track_related_later = False
+
+
+class DeliverySlotAdmin(admin.ModelAdmin):
+    readonly_fields = ['reserved']
+    list_display = ['starts_at', 'ends_at', 'capacity', 'reserved']
+    date_hierarchy = 'starts_at'
+
+
+class BroadcastAdmin(admin.ModelAdmin):
+    # Рассылки запускаются командой broadcast, здесь только их ход
+    list_display = [
+        'name', 'created_at', 'sent_count', 'failed_count', 'finished_at',
+    ]
+    readonly_fields = [
+        'last_chat_id', 'sent_count', 'failed_count', 'created_at',
+        'finished_at',
+    ]
+
+
+class DailySalesAdmin(admin.ModelAdmin):
+    list_display = ['day', 'orders_count', 'revenue', 'cakes_count',
+                    'get_average_cake_price']
+    date_hierarchy = 'day'
+    change_list_template = 'admin/bake_cake_bot/dailysales/change_list.html'
+    dashboard_periods = [7, 30, 90, 365]
+
+    @admin.display(description='Средняя цена торта')
+    def get_average_cake_price(self, obj):
+        return obj.get_average_cake_price()
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path(
+                'dashboard/',
+                self.admin_site.admin_view(self.dashboard_view),
+                name='bake_cake_bot_dailysales_dashboard',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def dashboard_view(self, request):
+        period = request.GET.get('days', '')
+        period = int(period) if period.isdigit() else 30
+        since = timezone.localdate() - timedelta(days=period - 1)
+        context = {
+            **self.admin_site.each_context(request),
+            **get_sales_dashboard(since),
+            'opts': self.model._meta,
+            'title': 'Продажи',
+            'period': period,
+            'periods': self.dashboard_periods,
+            'since': since,
+        }
+        return TemplateResponse(
+            request,
+            'admin/bake_cake_bot/dailysales/dashboard.html',
+            context
+        )
+
+
+class ArchivedCakeOptionInline(admin.TabularInline):
+    model = ArchivedCakeOption
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class ArchivedOrderAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ['id', 'client', 'created_at', 'total_amount']
+    list_select_related = ['client']
+    search_fields = ['=id', 'client__phone']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class ArchivedCakeAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ['id', 'order', 'price']
+    list_select_related = ['order']
+    raw_id_fields = ['order']
+    inlines = [ArchivedCakeOptionInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 admin.site.register(Client, ClientAdmin)
@@ -33,3 +252,8 @@ admin.site.register(Category, CategoryAdmin)
 admin.site.register(Option, OptionAdmin)
 admin.site.register(Cake, CakeAdmin)
 admin.site.register(Order, OrderAdmin)
+admin.site.register(DeliverySlot, DeliverySlotAdmin)
+admin.site.register(DailySales, DailySalesAdmin)
+admin.site.register(Broadcast, BroadcastAdmin)
+admin.site.register(ArchivedOrder, ArchivedOrderAdmin)
+admin.site.register(ArchivedCake, ArchivedCakeAdmin)
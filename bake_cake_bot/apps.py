@@ -1,6 +1,24 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, pre_delete
 
 
 class BakeCakeBotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bake_cake_bot'
+
+    def ready(self):
+        from bake_cake_bot.delivery import release_deleted_order_slot
+        from bake_cake_bot.models import Order
+        from bake_cake_bot.production import track_order_delete
+        from bake_cake_bot.production import track_order_status
+        from bake_cake_bot.sales import track_order_sales
+        from bake_cake_bot.sales import track_order_sales_delete
+        from bake_cake_bot.sqlite import tune_sqlite
+
+        connection_created.connect(tune_sqlite)
+        post_save.connect(track_order_status, sender=Order)
+        pre_delete.connect(track_order_delete, sender=Order)
+        post_save.connect(track_order_sales, sender=Order)
+        pre_delete.connect(track_order_sales_delete, sender=Order)
+        pre_delete.connect(release_deleted_order_slot, sender=Order)
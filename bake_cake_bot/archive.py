@@ -0,0 +1,98 @@
+import logging
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from bake_cake_bot.models import ArchivedCake, ArchivedCakeOption
+from bake_cake_bot.models import ArchivedOrder, Cake, CakeOption, Order
+
+
+logger = logging.getLogger(__name__)
+
+COMPLETED_STATUS = 4
+
+
+def archive_orders_batch(order_ids):
+    orders = list(Order.objects.filter(id__in=order_ids))
+    order_cakes = list(
+        Order.cakes.through.objects
+        .filter(order_id__in=order_ids)
+        .select_related('cake')
+    )
+    cake_ids = [order_cake.cake_id for order_cake in order_cakes]
+    cake_options = list(
+        CakeOption.objects
+        .filter(cake_id__in=cake_ids)
+        .select_related('option__category')
+    )
+
+    ArchivedOrder.objects.bulk_create([
+        ArchivedOrder(
+            id=order.id,
+            client_id=order.client_id,
+            total_amount=order.total_amount,
+            created_at=order.created_at,
+            modified_at=order.modified_at,
+        )
+        for order in orders
+    ])
+    archived_cake_ids = set()
+    archived_cakes = []
+    for order_cake in order_cakes:
+        # Торт, попавший в несколько заказов, архивируется один раз
+        if order_cake.cake_id in archived_cake_ids:
+            continue
+        archived_cake_ids.add(order_cake.cake_id)
+        archived_cakes.append(ArchivedCake(
+            id=order_cake.cake_id,
+            order_id=order_cake.order_id,
+            text=order_cake.cake.text,
+            price=order_cake.cake.price,
+            created_at=order_cake.cake.created_at,
+        ))
+    ArchivedCake.objects.bulk_create(archived_cakes)
+    ArchivedCakeOption.objects.bulk_create([
+        ArchivedCakeOption(
+            cake_id=cake_option.cake_id,
+            category_title=cake_option.option.category.title,
+            category_choice_order=cake_option.option.category.choice_order,
+            option_name=cake_option.option.name,
+            price=cake_option.price,
+        )
+        for cake_option in cake_options
+    ])
+
+    # Торты, которые входят еще и в неархивные заказы, остаются на месте
+    shared_cake_ids = (
+        Order.cakes.through.objects
+        .filter(cake_id__in=cake_ids)
+        .exclude(order_id__in=order_ids)
+        .values_list('cake_id', flat=True)
+    )
+    Cake.objects.filter(id__in=cake_ids).exclude(
+        id__in=list(shared_cake_ids)
+    ).delete()
+    Order.objects.filter(id__in=order_ids).delete()
+
+
+def archive_completed_orders(older_than_days, batch_size=500):
+    # Каждая пачка переносится в своей транзакции, чтобы не держать
+    # блокировки на горячих таблицах долго
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    archived_total = 0
+    while True:
+        order_ids = list(
+            Order.objects
+            .filter(status=COMPLETED_STATUS, created_at__lt=cutoff)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            break
+        with transaction.atomic():
+            archive_orders_batch(order_ids)
+        archived_total += len(order_ids)
+        logger.info('Archived %s orders', archived_total)
+    return archived_total
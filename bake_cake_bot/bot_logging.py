@@ -0,0 +1,42 @@
+import contextvars
+import logging
+import random
+
+
+LOG_FORMAT = (
+    '%(asctime)s - %(name)s - %(levelname)s - '
+    'update=%(update_id)s - %(message)s'
+)
+
+_update_id = contextvars.ContextVar('update_id', default='-')
+
+
+def bind_update(update, context):
+    # Запоминаем id апдейта, чтобы все записи лога при его обработке
+    # можно было связать между собой
+    _update_id.set(update.update_id)
+
+
+class UpdateContextFilter(logging.Filter):
+    def filter(self, record):
+        record.update_id = _update_id.get()
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    def __init__(self, sample_rate):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        return random.random() < self.sample_rate
+
+
+def configure_logging(level='INFO', debug_sample_rate=1.0):
+    logging.basicConfig(format=LOG_FORMAT, level=level)
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(UpdateContextFilter())
+        if debug_sample_rate < 1:
+            handler.addFilter(DebugSamplingFilter(debug_sample_rate))
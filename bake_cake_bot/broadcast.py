@@ -0,0 +1,127 @@
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.utils import timezone
+from telegram.error import BadRequest, RetryAfter, TelegramError, Unauthorized
+
+from bake_cake_bot.models import Client
+from bake_cake_bot.throttling import RateLimiter
+
+
+logger = logging.getLogger(__name__)
+
+# Сетевые ошибки повторяем, но не бесконечно
+SEND_ATTEMPTS = 3
+
+
+def get_recipients(broadcast):
+    # Только клиенты с согласием, после контрольной точки
+    return (
+        Client.objects
+        .filter(
+            pd_proccessing_consent=True,
+            tg_chat_id__gt=broadcast.last_chat_id,
+        )
+        .order_by('tg_chat_id')
+    )
+
+
+def send_message(bot, limiter, chat_id, text):
+    attempts = 0
+    while True:
+        limiter.wait()
+        try:
+            bot.send_message(chat_id, text)
+            return True
+        except RetryAfter as error:
+            limiter.pause(error.retry_after)
+        except (Unauthorized, BadRequest) as error:
+            # Клиент заблокировал бота или удалил чат, повтор не поможет
+            logger.info('Broadcast to chat %s failed: %s', chat_id, error)
+            return False
+        except TelegramError as error:
+            attempts += 1
+            if attempts >= SEND_ATTEMPTS:
+                logger.warning(
+                    'Broadcast to chat %s failed: %s',
+                    chat_id,
+                    error
+                )
+                return False
+
+
+def save_checkpoint(broadcast, chat_ids, results):
+    if not chat_ids:
+        return
+    sent_count = sum(results)
+    broadcast.last_chat_id = chat_ids[-1]
+    broadcast.sent_count += sent_count
+    broadcast.failed_count += len(results) - sent_count
+    broadcast.save(
+        update_fields=['last_chat_id', 'sent_count', 'failed_count']
+    )
+
+
+def wait_started(futures):
+    # Еще не начатые отправки отменяются с конца пачки: потоки берут
+    # задачи по порядку, поэтому начатые всегда образуют начало пачки
+    for future in reversed(futures):
+        future.cancel()
+    results = []
+    for future in futures:
+        if future.cancelled():
+            break
+        results.append(future.result())
+    return results
+
+
+def run_broadcast(broadcast, bot, rate, workers, batch_size=100):
+    # Клиенты читаются одним потоком по возрастанию ID чата, отправка
+    # идет пачками в несколько потоков под общим ограничением частоты.
+    # После каждой пачки сохраняется контрольная точка
+    limiter = RateLimiter(rate)
+    chat_ids = (
+        get_recipients(broadcast)
+        .values_list('tg_chat_id', flat=True)
+        .iterator(chunk_size=batch_size)
+    )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            batch = list(islice(chat_ids, batch_size))
+            if not batch:
+                break
+            futures = [
+                executor.submit(
+                    send_message,
+                    bot,
+                    limiter,
+                    chat_id,
+                    broadcast.text
+                )
+                for chat_id in batch
+            ]
+            try:
+                results = [future.result() for future in futures]
+            except KeyboardInterrupt:
+                results = wait_started(futures)
+                save_checkpoint(broadcast, batch[:len(results)], results)
+                logger.info(
+                    'Broadcast %s interrupted after chat %s',
+                    broadcast.name,
+                    broadcast.last_chat_id
+                )
+                raise
+            save_checkpoint(broadcast, batch, results)
+            logger.info(
+                'Broadcast %s: sent %s, failed %s, last chat %s',
+                broadcast.name,
+                broadcast.sent_count,
+                broadcast.failed_count,
+                broadcast.last_chat_id
+            )
+
+    broadcast.finished_at = timezone.now()
+    broadcast.save(update_fields=['finished_at'])
+    return broadcast
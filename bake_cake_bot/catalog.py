@@ -0,0 +1,61 @@
+from itertools import accumulate
+
+
+class OptionCatalog:
+    # Снимок каталога в памяти: категории в порядке выбора
+    # и цены параметров, посчитанные один раз при загрузке
+    def __init__(self, categories):
+        self.categories = list(categories)
+        self.option_prices = {}
+        self.option_titles = {}
+        self.option_layers = {}
+        min_prices = []
+        max_prices = []
+        for category_index, category in enumerate(self.categories):
+            prices = []
+            for option in category.options.all():
+                self.option_prices[option.id] = option.price
+                self.option_titles[option.id] = (category.title, option.name)
+                if option.layer:
+                    self.option_layers[option.id] = (
+                        category_index,
+                        option.layer.name,
+                    )
+                prices.append(option.price)
+            if not prices:
+                prices = [0]
+            # Необязательную категорию можно пропустить
+            min_prices.append(min(prices) if category.is_mandatory else 0)
+            max_prices.append(max(prices))
+        self.min_prices = min_prices
+        self.max_prices = max_prices
+
+        # Суммы по оставшимся категориям: remaining[i] - от i-й до конца
+        self.remaining_min = list(accumulate(reversed(min_prices)))[::-1]
+        self.remaining_min.append(0)
+        self.remaining_max = list(accumulate(reversed(max_prices)))[::-1]
+        self.remaining_max.append(0)
+
+    def __len__(self):
+        return len(self.categories)
+
+    def __getitem__(self, index):
+        return self.categories[index]
+
+    def get_layers(self, option_ids):
+        # Имена слоев картинки в хранилище в порядке категорий
+        return [
+            layer_name
+            for category_index, layer_name in sorted(
+                self.option_layers[option_id]
+                for option_id in option_ids
+                if option_id in self.option_layers
+            )
+        ]
+
+    def get_price_range(self, current_price, category_index):
+        category_index = min(category_index, len(self.categories))
+        return (
+            current_price + self.remaining_min[category_index],
+            current_price + self.remaining_max[category_index],
+        )
@@ -0,0 +1,62 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+# Ниже этого порога точный COUNT(*) достаточно быстрый
+EXACT_COUNT_LIMIT = 10000
+
+
+def get_estimated_count(queryset):
+    # Оценка из статистики планировщика есть только в PostgreSQL
+    # и подходит только для списка без фильтров
+    query = queryset.query
+    if query.where or query.distinct or query.combinator:
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    if not row or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        estimated_count = get_estimated_count(self.object_list)
+        if estimated_count is None or estimated_count < EXACT_COUNT_LIMIT:
+            return self.object_list.count()
+        return estimated_count
+
+
+class LargeTableAdminMixin:
+    # Для больших таблиц: без второго COUNT(*) по всей таблице,
+    # с оценкой числа строк и поиском по началу значения,
+    # который использует обычные индексы вместо LIKE '%...%'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term or not self.search_fields:
+            return queryset, False
+
+        search_query = Q()
+        for field_name in self.search_fields:
+            if field_name.startswith('='):
+                if search_term.isdigit():
+                    search_query |= Q(**{field_name[1:]: int(search_term)})
+                continue
+            for term in {search_term, search_term.capitalize()}:
+                search_query |= Q(**{f'{field_name}__startswith': term})
+        if not search_query:
+            return queryset.none(), False
+        return queryset.filter(search_query), False
@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+from telegram.ext import ConversationHandler
+
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedConversationHandler(ConversationHandler):
+    # Разговоры упорядочены по последней активности: молчащие дольше
+    # idle_timeout завершаются периодической проверкой, а сверх
+    # max_conversations сразу вытесняются самые давние.
+    # on_expire(key) вызывается для каждого завершенного так разговора
+    def __init__(self, *args, idle_timeout, max_conversations,
+                 on_expire=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.idle_timeout = idle_timeout
+        self.max_conversations = max_conversations
+        self.on_expire = on_expire
+        self.expired_count = 0
+        self.evicted_count = 0
+        self._active_at = OrderedDict()
+        self._active_lock = threading.Lock()
+
+    def handle_update(self, update, dispatcher, check_result, context=None):
+        key = check_result[0]
+        # Активность отмечается и до обработки: долгий апдейт не должен
+        # попасть под проверку простоя, пока он еще выполняется
+        with self._active_lock:
+            if key in self._active_at:
+                self._mark_active(key)
+        try:
+            return super().handle_update(
+                update,
+                dispatcher,
+                check_result,
+                context
+            )
+        finally:
+            self._touch(key)
+
+    def _touch(self, key):
+        evicted_keys = []
+        with self._active_lock:
+            if key not in self.conversations:
+                # Разговор завершился обычным путем
+                self._active_at.pop(key, None)
+                return
+            self._mark_active(key)
+            while len(self._active_at) > self.max_conversations:
+                evicted_key, _ = self._active_at.popitem(last=False)
+                evicted_keys.append(evicted_key)
+            self.evicted_count += len(evicted_keys)
+        for evicted_key in evicted_keys:
+            self._end(evicted_key)
+
+    def _mark_active(self, key):
+        self._active_at[key] = time.monotonic()
+        self._active_at.move_to_end(key)
+
+    def expire_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        expired_keys = []
+        with self._active_lock:
+            for key, active_at in self._active_at.items():
+                if active_at >= cutoff:
+                    break
+                expired_keys.append(key)
+            for key in expired_keys:
+                del self._active_at[key]
+            self.expired_count += len(expired_keys)
+        for key in expired_keys:
+            self._end(key)
+        if expired_keys:
+            logger.info('Expired %s idle conversations', len(expired_keys))
+
+    def _end(self, key):
+        self._update_state(self.END, key)
+        if self.on_expire:
+            try:
+                self.on_expire(key)
+            except Exception:
+                logger.exception('Failed to clean up conversation %s', key)
+
+    def get_stats(self):
+        return {
+            'live': len(self.conversations),
+            'expired': self.expired_count,
+            'evicted': self.evicted_count,
+        }
@@ -0,0 +1,126 @@
+import logging
+import threading
+
+from array import array
+from itertools import groupby
+
+from bake_cake_bot.models import CakeOption, Option
+
+
+logger = logging.getLogger(__name__)
+
+# Рекомендуем параметр, только если предыдущий выбор встречался
+# достаточно часто и вместе с ним параметр берут хотя бы в такой доле тортов
+MIN_SUPPORT = 5
+MIN_SHARE = 0.3
+
+
+class CooccurrenceMatrix:
+    # Плотная матрица n x n в одном массиве: ячейка [a * n + b] - сколько
+    # тортов содержат оба параметра, на диагонали - сколько тортов
+    # содержат параметр вообще
+    def __init__(self, option_ids):
+        self.option_indexes = {
+            option_id: index
+            for index, option_id in enumerate(option_ids)
+        }
+        self.size = len(self.option_indexes)
+        self.counts = array('L', [0]) * (self.size * self.size)
+        self.lock = threading.Lock()
+
+    def get_indexes(self, option_ids):
+        return [
+            self.option_indexes[option_id]
+            for option_id in option_ids
+            if option_id in self.option_indexes
+        ]
+
+    def add_cake(self, option_ids):
+        indexes = self.get_indexes(option_ids)
+        size = self.size
+        counts = self.counts
+        with self.lock:
+            for row_index in indexes:
+                row_start = row_index * size
+                for column_index in indexes:
+                    counts[row_start + column_index] += 1
+
+    def recommend(self, chosen_option_ids, candidate_option_ids):
+        size = self.size
+        counts = self.counts
+        rows = [
+            (index * size, counts[index * size + index])
+            for index in self.get_indexes(chosen_option_ids)
+            if counts[index * size + index] >= MIN_SUPPORT
+        ]
+        if not rows:
+            return None
+
+        best_option_id = None
+        best_share = MIN_SHARE * len(rows)
+        for option_id in candidate_option_ids:
+            column_index = self.option_indexes.get(option_id)
+            if column_index is None:
+                continue
+            share = sum(
+                counts[row_start + column_index] / row_total
+                for row_start, row_total in rows
+            )
+            if share >= best_share:
+                best_option_id = option_id
+                best_share = share
+        return best_option_id
+
+
+def build_cooccurrence_matrix(batch_size=2000):
+    matrix = CooccurrenceMatrix(
+        Option.objects.order_by('id').values_list('id', flat=True)
+    )
+    # История читается потоком, отсортированным по торту,
+    # и в память попадает только одна пачка строк
+    cake_options = (
+        CakeOption.objects
+        .filter(cake__in_orders__status__gte=1)
+        .order_by('cake_id')
+        .values_list('cake_id', 'option_id')
+        .iterator(chunk_size=batch_size)
+    )
+    cakes_count = 0
+    for cake_id, rows in groupby(cake_options, key=lambda row: row[0]):
+        matrix.add_cake([option_id for _, option_id in rows])
+        cakes_count += 1
+    logger.info(
+        'Built co-occurrence matrix of %s options from %s cakes',
+        matrix.size,
+        cakes_count
+    )
+    return matrix
+
+
+_matrix = None
+_matrix_lock = threading.Lock()
+
+
+def get_cooccurrence_matrix():
+    global _matrix
+
+    if _matrix is None:
+        with _matrix_lock:
+            if _matrix is None:
+                _matrix = build_cooccurrence_matrix()
+    return _matrix
+
+
+def rebuild_cooccurrence_matrix():
+    # Новая матрица собирается рядом со старой и подменяет ее целиком
+    global _matrix
+
+    with _matrix_lock:
+        _matrix = build_cooccurrence_matrix()
+    return _matrix
+
+
+def record_cake(option_ids):
+    # Новый торт учитывается сразу, без пересборки матрицы
+    if _matrix is not None:
+        _matrix.add_cake(option_ids)
@@ -0,0 +1,153 @@
+import logging
+
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from bake_cake_bot.models import DeliverySlot, Order
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_day_bounds(day):
+    day_start = timezone.make_aware(datetime.combine(day, time.min))
+    return day_start, day_start + timedelta(days=1)
+
+
+def get_day_cache_key(day):
+    return f'delivery_slots:{day.isoformat()}'
+
+
+def get_day_slots(day):
+    # Список слотов на день кешируется ненадолго: устаревший остаток
+    # не опасен, потому что бронирование проверяет вместимость в самом UPDATE
+    cache_key = get_day_cache_key(day)
+    day_slots = cache.get(cache_key)
+    if day_slots is not None:
+        return day_slots
+
+    day_start, day_end = get_day_bounds(day)
+    day_slots = [
+        {
+            'id': slot.id,
+            'starts_at': slot.starts_at,
+            'title': str(slot),
+            'free': slot.capacity - slot.reserved,
+        }
+        for slot in DeliverySlot.objects.filter(
+            starts_at__gte=day_start,
+            starts_at__lt=day_end,
+        )
+    ]
+    cache.set(
+        cache_key,
+        day_slots,
+        timeout=settings.DELIVERY_SLOTS_CACHE_SECONDS
+    )
+    return day_slots
+
+
+def get_available_slots(day):
+    now = timezone.now()
+    return [
+        slot for slot in get_day_slots(day)
+        if slot['free'] > 0 and slot['starts_at'] > now
+    ]
+
+
+def get_available_days(days_count=None):
+    if days_count is None:
+        days_count = settings.DELIVERY_SLOT_DAYS
+    today = timezone.localdate()
+    days = [today + timedelta(days=offset) for offset in range(days_count)]
+    return [day for day in days if get_available_slots(day)]
+
+
+def forget_slot_day(starts_at):
+    cache.delete(get_day_cache_key(timezone.localdate(starts_at)))
+
+
+def reserve_slot(slot_id):
+    # Условный UPDATE не дает превысить вместимость без блокировок
+    # и без чтения остатка перед записью
+    return bool(
+        DeliverySlot.objects
+        .filter(
+            id=slot_id,
+            reserved__lt=F('capacity'),
+            starts_at__gt=timezone.now(),
+        )
+        .update(reserved=F('reserved') + 1)
+    )
+
+
+def release_slots(slot_counts):
+    for slot_id, orders_count in slot_counts.items():
+        (
+            DeliverySlot.objects
+            .filter(id=slot_id, reserved__gte=orders_count)
+            .update(reserved=F('reserved') - orders_count)
+        )
+
+
+def release_deleted_order_slot(sender, instance, **kwargs):
+    # Место освобождается при любом удалении заказа: из админки, очисткой
+    # черновиков или отменой в боте. Прошедшие доставки не трогаем,
+    # их слоты уже не бронируются
+    if not instance.delivery_slot_id:
+        return
+    is_released = (
+        DeliverySlot.objects
+        .filter(
+            id=instance.delivery_slot_id,
+            reserved__gte=1,
+            starts_at__gt=timezone.now(),
+        )
+        .update(reserved=F('reserved') - 1)
+    )
+    if is_released:
+        transaction.on_commit(
+            lambda: forget_slot_day(instance.delivery_slot.starts_at)
+        )
+
+
+def clear_order_slot(order_id):
+    # Место в уже начавшемся слоте не освобождается: его все равно
+    # больше не забронировать
+    Order.objects.filter(id=order_id).update(
+        delivery_slot=None,
+        modified_at=timezone.now(),
+    )
+
+
+def book_order_slot(order_id, slot_id):
+    order = Order.objects.select_related('delivery_slot').get(id=order_id)
+    previous_slot = order.delivery_slot
+    if previous_slot and previous_slot.id == slot_id:
+        return previous_slot
+
+    with transaction.atomic():
+        if not reserve_slot(slot_id):
+            slot = DeliverySlot.objects.filter(id=slot_id).first()
+            if slot:
+                forget_slot_day(slot.starts_at)
+            logger.info('Delivery slot %s is full', slot_id)
+            return None
+
+        if previous_slot:
+            release_slots({previous_slot.id: 1})
+        Order.objects.filter(id=order_id).update(
+            delivery_slot_id=slot_id,
+            modified_at=timezone.now(),
+        )
+
+    if previous_slot:
+        forget_slot_day(previous_slot.starts_at)
+    slot = DeliverySlot.objects.get(id=slot_id)
+    forget_slot_day(slot.starts_at)
+    return slot
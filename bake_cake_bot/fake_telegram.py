@@ -0,0 +1,172 @@
+import json
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegramState:
+    # Очередь входящих апдейтов и учет исходящих сообщений бота,
+    # общие для всех потоков HTTP-сервера
+    def __init__(self, on_reply=None):
+        self.on_reply = on_reply
+        self.polling_started = threading.Event()
+        self.calls_count = {}
+        self._condition = threading.Condition()
+        self._updates = []
+        # Как и в Телеграме, номера апдейтов не повторяются между запусками,
+        # иначе бот отбросит их как уже обработанные
+        self._next_update_id = int(time.time() * 1000)
+        self._next_message_id = 1
+
+    def push_message(self, chat_id, text):
+        message = {
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Load'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [
+                {'type': 'bot_command', 'offset': 0, 'length': len(text)},
+            ]
+        with self._condition:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            message['message_id'] = self._get_message_id()
+            self._updates.append({'update_id': update_id, 'message': message})
+            self._condition.notify_all()
+        return update_id
+
+    def get_updates(self, offset=None, limit=100, timeout=0):
+        deadline = time.monotonic() + (timeout or 0)
+        with self._condition:
+            if offset:
+                self._updates = [
+                    update for update in self._updates
+                    if update['update_id'] >= offset
+                ]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return self._updates[:limit]
+
+    def send(self, method, data):
+        chat_id = int(data['chat_id'])
+        with self._condition:
+            message_id = self._get_message_id()
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': data.get('text', ''),
+        }
+        if method == 'sendPhoto':
+            # Повторная отправка приходит с file_id вместо файла
+            file_id = data.get('photo') or f'photo{message_id}'
+            message['photo'] = [{
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'width': 512,
+                'height': 512,
+            }]
+        reply_markup = data.get('reply_markup')
+        if isinstance(reply_markup, str):
+            reply_markup = json.loads(reply_markup)
+        if self.on_reply:
+            self.on_reply(chat_id, method, message['text'], reply_markup)
+        return message
+
+    def count_call(self, method):
+        with self._condition:
+            self.calls_count[method] = self.calls_count.get(method, 0) + 1
+
+    def _get_message_id(self):
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return message_id
+
+
+def parse_request_data(content_type, body):
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    # Файлы приходят multipart-формой, нужны только текстовые поля
+    fields = re.findall(
+        rb'name="([^"]+)"\r\n(?:[^\r\n]+\r\n)*\r\n(.*?)\r\n--',
+        body,
+        re.S,
+    )
+    return {
+        name.decode(): value.decode(errors='replace')
+        for name, value in fields
+        if name not in (b'document', b'photo')
+    }
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        data = parse_request_data(self.headers.get('Content-Type', ''), body)
+        self.state.count_call(method)
+
+        if method == 'getMe':
+            result = {
+                'id': 1,
+                'is_bot': True,
+                'first_name': 'BakeCakeBot',
+                'username': 'bake_cake_load_bot',
+            }
+        elif method in ('setWebhook', 'deleteWebhook'):
+            result = True
+        elif method == 'getUpdates':
+            self.state.polling_started.set()
+            # Bot API принимает числа и в виде строк
+            result = self.state.get_updates(
+                offset=int(data.get('offset') or 0),
+                limit=int(data.get('limit') or 100),
+                timeout=float(data.get('timeout') or 0),
+            )
+        elif method in ('sendMessage', 'sendDocument', 'sendPhoto'):
+            result = self.state.send(method, data)
+        else:
+            self._reply(404, {
+                'ok': False,
+                'error_code': 404,
+                'description': 'Not Found',
+            })
+            return
+        self._reply(200, {'ok': True, 'result': result})
+
+    do_GET = do_POST
+
+    def _reply(self, status, payload):
+        content = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        return
+
+
+def start_fake_telegram(state, host='127.0.0.1', port=8081):
+    handler = type(
+        'BoundFakeTelegramHandler',
+        (FakeTelegramHandler,),
+        {'state': state},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
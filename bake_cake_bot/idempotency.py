@@ -0,0 +1,142 @@
+import logging
+import threading
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from telegram.ext import DispatcherHandlerStop
+
+from bake_cake_bot.models import ProcessedAction, ProcessedUpdate
+from bake_cake_bot.scheduling import is_scheduler_worker
+
+
+logger = logging.getLogger(__name__)
+
+
+class RecentKeys:
+    # Ограниченный по размеру LRU: самые старые ключи вытесняются
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def add(self, key, value=True):
+        # Возвращает False, если ключ уже был
+        with self._lock:
+            is_new = key not in self._items
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+            return is_new
+
+
+class UpdateDeduplicator:
+    # Повторно доставленные апдейты отбрасываются до всех обработчиков.
+    # Завершенные апдейты пачками записываются в базу, чтобы после
+    # перезапуска бот помнил, что уже успел обработать
+    def __init__(self, max_size, retention):
+        self.retention = retention
+        self.duplicates_count = 0
+        self._recent = RecentKeys(max_size)
+        self._processed = []
+        self._lock = threading.Lock()
+
+    def load(self):
+        since = timezone.now() - self.retention
+        update_ids = (
+            ProcessedUpdate.objects
+            .filter(processed_at__gte=since)
+            .order_by('-update_id')
+            .values_list('update_id', flat=True)[:self._recent.max_size]
+        )
+        for update_id in reversed(list(update_ids)):
+            self._recent.add(update_id)
+        logger.info('Loaded %s processed update ids', len(self._recent))
+
+    def check_update(self, update, context):
+        # В потоках планировщика апдейт уже прошел проверку
+        if is_scheduler_worker():
+            return
+        if not self._recent.add(update.update_id):
+            self.duplicates_count += 1
+            logger.info('Skip duplicate update %s', update.update_id)
+            raise DispatcherHandlerStop()
+
+    def mark_processed(self, update, context):
+        with self._lock:
+            self._processed.append(update.update_id)
+
+    def flush(self):
+        with self._lock:
+            update_ids, self._processed = self._processed, []
+        if update_ids:
+            ProcessedUpdate.objects.bulk_create(
+                [ProcessedUpdate(update_id=update_id)
+                 for update_id in update_ids],
+                ignore_conflicts=True
+            )
+        cutoff = timezone.now() - self.retention
+        ProcessedUpdate.objects.filter(processed_at__lt=cutoff).delete()
+        ProcessedAction.objects.filter(created_at__lt=cutoff).delete()
+
+    def get_stats(self):
+        return {
+            'duplicates': self.duplicates_count,
+            'recent': len(self._recent),
+            'unsaved': len(self._processed),
+        }
+
+
+_recent_actions = RecentKeys(settings.IDEMPOTENCY_CACHE_SIZE)
+
+
+def run_once(key, action):
+    # Действие выполняется один раз на ключ, повтор возвращает
+    # сохраненный результат без записи в базу
+    result = _recent_actions.get(key)
+    if result is not None:
+        return result
+
+    result = (
+        ProcessedAction.objects
+        .filter(key=key)
+        .values_list('result', flat=True)
+        .first()
+    )
+    if result is None:
+        try:
+            with transaction.atomic():
+                # Ключ записывается первым запросом транзакции: в SQLite
+                # она сразу берет блокировку на запись и ждет ее по
+                # busy_timeout, а не падает при переходе от чтения к записи
+                ProcessedAction.objects.create(key=key)
+                result = action()
+                ProcessedAction.objects.filter(key=key).update(result=result)
+        except IntegrityError:
+            # То же действие успели выполнить параллельно, наше откатилось
+            result = (
+                ProcessedAction.objects
+                .filter(key=key)
+                .values_list('result', flat=True)
+                .first()
+            )
+            if result is None:
+                raise
+    else:
+        logger.info('Skip repeated action %s', key)
+
+    _recent_actions.add(key, result)
+    return result
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from bake_cake_bot.archive import archive_completed_orders
+
+
+class Command(BaseCommand):
+    help = 'Move completed orders with their cakes into archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=90,
+            help='Archive completed orders created earlier than this',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of orders moved in one transaction',
+        )
+
+    def handle(self, *args, **options):
+        archived_count = archive_completed_orders(
+            options['older_than_days'],
+            options['batch_size'],
+        )
+        self.stdout.write(f'Archived {archived_count} orders')
@@ -0,0 +1,95 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from telegram import Bot
+from telegram.utils.request import Request
+
+from bake_cake_bot.bot_logging import configure_logging
+from bake_cake_bot.broadcast import get_recipients, run_broadcast
+from bake_cake_bot.models import Broadcast
+
+
+class Command(BaseCommand):
+    help = (
+        'Send a message to all clients with consent. '
+        'Running it again with the same name resumes from the checkpoint'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Unique name of the broadcast')
+        parser.add_argument(
+            '--text',
+            help='Message text, required for a new broadcast',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=settings.BROADCAST_RATE,
+            help='Messages per second for all workers together',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.BROADCAST_WORKERS,
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Messages sent between two checkpoints',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count recipients and estimate the duration',
+        )
+
+    def handle(self, *args, **options):
+        broadcast = Broadcast.objects.filter(name=options['name']).first()
+        if broadcast is None:
+            if not options['text']:
+                raise CommandError('--text is required for a new broadcast')
+            broadcast = Broadcast(name=options['name'], text=options['text'])
+        elif options['text'] and options['text'] != broadcast.text:
+            raise CommandError(
+                f'Broadcast {broadcast.name} already exists with another text'
+            )
+        if broadcast.finished_at:
+            raise CommandError(
+                f'Broadcast {broadcast.name} finished at '
+                f'{timezone.localtime(broadcast.finished_at):%d.%m.%Y %H:%M}'
+            )
+
+        recipients_count = get_recipients(broadcast).count()
+        estimated_duration = timedelta(
+            seconds=round(recipients_count / options['rate'])
+        )
+        self.stdout.write(
+            f'Recipients left: {recipients_count}, '
+            f'estimated duration: {estimated_duration}'
+        )
+        if options['dry_run']:
+            return
+
+        configure_logging(
+            settings.LOG_LEVEL,
+            settings.LOG_DEBUG_SAMPLE_RATE,
+        )
+        bot = Bot(
+            settings.TG_TOKEN,
+            base_url=settings.TG_API_URL,
+            request=Request(con_pool_size=options['workers'] + 4),
+        )
+        broadcast.save()
+        run_broadcast(
+            broadcast,
+            bot,
+            options['rate'],
+            options['workers'],
+            options['batch_size'],
+        )
+        self.stdout.write(
+            f'Sent {broadcast.sent_count}, failed {broadcast.failed_count}'
+        )
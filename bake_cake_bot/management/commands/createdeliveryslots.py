@@ -0,0 +1,73 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from bake_cake_bot.models import DeliverySlot
+
+
+class Command(BaseCommand):
+    help = 'Create delivery time slots for the upcoming days'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.DELIVERY_SLOT_DAYS,
+            help='Number of days starting from today',
+        )
+        parser.add_argument(
+            '--first-hour',
+            type=int,
+            default=10,
+            help='Hour when the first slot of the day starts',
+        )
+        parser.add_argument(
+            '--last-hour',
+            type=int,
+            default=20,
+            help='Hour when the last slot of the day ends',
+        )
+        parser.add_argument(
+            '--slot-hours',
+            type=int,
+            default=2,
+            help='Length of one slot in hours',
+        )
+        parser.add_argument(
+            '--capacity',
+            type=int,
+            default=5,
+            help='Number of deliveries in one slot',
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        slot_length = timedelta(hours=options['slot_hours'])
+        slots = []
+        for offset in range(options['days']):
+            day = today + timedelta(days=offset)
+            starts_at = timezone.make_aware(
+                datetime.combine(day, time(options['first_hour']))
+            )
+            day_end = timezone.make_aware(
+                datetime.combine(day, time(options['last_hour']))
+            )
+            while starts_at + slot_length <= day_end:
+                slots.append(DeliverySlot(
+                    starts_at=starts_at,
+                    ends_at=starts_at + slot_length,
+                    capacity=options['capacity'],
+                ))
+                starts_at += slot_length
+
+        # Уже существующие слоты не трогаем, чтобы не сбросить брони
+        existing = set(
+            DeliverySlot.objects
+            .filter(starts_at__in=[slot.starts_at for slot in slots])
+            .values_list('starts_at', flat=True)
+        )
+        new_slots = [slot for slot in slots if slot.starts_at not in existing]
+        DeliverySlot.objects.bulk_create(new_slots)
+        self.stdout.write(f'Created {len(new_slots)} delivery slots')
@@ -0,0 +1,331 @@
+import os
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from bake_cake_bot.fake_telegram import FakeTelegramState, start_fake_telegram
+from bake_cake_bot.models import Cake, Client, Order
+
+
+PHONE = '+79161234567'
+ADDRESS = 'Москва, ул. Тестовая, д. 1'
+INSCRIPTION = 'С днем рождения!'
+
+# Начало вопросов без клавиатуры, после которых бот ждет ввода от клиента
+TEXT_PROMPTS = ('Введите', 'Пожалуйста, укажите')
+
+BUTTONS_PRIORITY = [
+    'Принять соглашение',
+    'Подтвердить заказ',
+    'Оформить заказ',
+    'Собрать торт',
+]
+
+
+def get_percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+class LoadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.updates_sent = 0
+        self.timeouts = 0
+        self.not_understood = 0
+        self.orders_confirmed = 0
+
+    def add(self, **counters):
+        with self.lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def add_latency(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+
+class VirtualCustomer:
+    # Проходит сценарий от /start до подтверждения заказа,
+    # выбирая кнопки из последней присланной клавиатуры
+    def __init__(self, chat_id, state, stats, reply_timeout, think_time=0,
+                 cakes_per_order=1, max_steps=30):
+        self.chat_id = chat_id
+        self.state = state
+        self.stats = stats
+        self.reply_timeout = reply_timeout
+        self.think_time = think_time
+        self.cakes_left = cakes_per_order - 1
+        self.max_steps = max_steps * cakes_per_order
+        self.inbox = queue.Queue()
+
+    def run(self):
+        action = '/start'
+        for _ in range(self.max_steps):
+            replies = self.send(action)
+            if not replies:
+                self.stats.add(timeouts=1)
+                return
+            action = self.choose_action(replies)
+            if action is None:
+                return
+            time.sleep(self.think_time)
+
+    def send(self, text):
+        sent_at = time.monotonic()
+        self.state.push_message(self.chat_id, text)
+        self.stats.add(updates_sent=1)
+        try:
+            replies = [self.inbox.get(timeout=self.reply_timeout)]
+        except queue.Empty:
+            return []
+        self.stats.add_latency(time.monotonic() - sent_at)
+        # Бот отвечает на апдейт несколькими сообщениями,
+        # ответ закончен, когда пришла клавиатура или вопрос
+        while not self.is_reply_finished(replies[-1]):
+            try:
+                replies.append(self.inbox.get(timeout=self.reply_timeout))
+            except queue.Empty:
+                break
+        return replies
+
+    @staticmethod
+    def is_reply_finished(reply):
+        text, reply_markup = reply
+        if reply_markup or 'не понял' in text:
+            return True
+        return text.startswith(TEXT_PROMPTS)
+
+    def choose_action(self, replies):
+        texts = [text for text, reply_markup in replies]
+        if any('подтвержден' in text for text in texts):
+            self.stats.add(orders_confirmed=1)
+            return None
+        if any('не понял' in text for text in texts):
+            self.stats.add(not_understood=1)
+            return None
+
+        last_text = texts[-1]
+        if 'номер телефона' in last_text:
+            return PHONE
+        if 'адрес доставки' in last_text:
+            return ADDRESS
+        if 'надпись' in last_text:
+            return INSCRIPTION
+
+        buttons = []
+        for text, reply_markup in replies:
+            if reply_markup and 'keyboard' in reply_markup:
+                buttons = [
+                    button['text'] if isinstance(button, dict) else button
+                    for row in reply_markup['keyboard']
+                    for button in row
+                ]
+        if self.cakes_left and 'Добавить еще торт' in buttons:
+            self.cakes_left -= 1
+            return 'Добавить еще торт'
+        for button in BUTTONS_PRIORITY:
+            if button in buttons:
+                return button
+        option_buttons = [button for button in buttons if 'руб. #' in button]
+        if option_buttons:
+            return random.choice(option_buttons)
+        delivery_buttons = [
+            button for button in buttons
+            if button.startswith(('Доставка ', 'Время доставки №'))
+        ]
+        if delivery_buttons:
+            return random.choice(delivery_buttons)
+        if 'Пропустить' in buttons:
+            return 'Пропустить'
+        return None
+
+
+def get_load_clients(first_chat_id, customers_count):
+    return Client.objects.filter(
+        tg_chat_id__gte=first_chat_id,
+        tg_chat_id__lt=first_chat_id + customers_count,
+    )
+
+
+def delete_load_data(clients):
+    # Заказы удаляются через ORM: их pre_delete вычитают заказы из сводок
+    # продаж и плана производства и освобождают слоты доставки
+    with transaction.atomic():
+        Order.objects.filter(client__in=clients).delete()
+        Cake.objects.filter(created_by__in=clients).delete()
+        _, deleted_counts = clients.delete()
+    return deleted_counts.get('bake_cake_bot.Client', 0)
+
+
+def wait_polling_started(state, bot_process, timeout):
+    deadline = time.monotonic() + timeout
+    while not state.polling_started.wait(0.5):
+        if bot_process and bot_process.poll() is not None:
+            raise CommandError(
+                f'Bot exited with code {bot_process.returncode} '
+                'before polling started'
+            )
+        if time.monotonic() > deadline:
+            raise CommandError(f'Bot did not start polling in {timeout} s')
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a load test against a local fake Telegram Bot API server. '
+        'Customers and their orders are written to the configured database '
+        'and deleted when the run ends'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument(
+            '--reply-timeout',
+            type=float,
+            default=10,
+            help='Seconds to wait for the first reply to an update',
+        )
+        parser.add_argument(
+            '--think-time',
+            type=float,
+            default=0,
+            help=(
+                'Seconds a customer waits before pressing the next button. '
+                'Without it customers may hit the per-chat rate limit'
+            ),
+        )
+        parser.add_argument(
+            '--cakes-per-order',
+            type=int,
+            default=1,
+            help='Cakes every customer puts in the cart before checkout',
+        )
+        parser.add_argument(
+            '--first-chat-id',
+            type=int,
+            default=10 ** 9,
+            help='Chat ids of virtual customers start from this value',
+        )
+        parser.add_argument(
+            '--start-timeout',
+            type=float,
+            default=60,
+            help='Seconds to wait for the bot to start polling',
+        )
+        parser.add_argument(
+            '--keep-data',
+            action='store_true',
+            help='Keep the virtual customers and their orders after the run',
+        )
+        parser.add_argument(
+            '--spawn-bot',
+            action='store_true',
+            help='Start runbot pointed at the fake server as a subprocess',
+        )
+
+    def handle(self, *args, **options):
+        load_clients = get_load_clients(
+            options['first_chat_id'],
+            options['customers'],
+        )
+        # Удаляются только клиенты, которых создал этот прогон
+        if not options['keep_data'] and load_clients.exists():
+            raise CommandError(
+                'Clients with chat ids from '
+                f'{options["first_chat_id"]} already exist, '
+                'pass another --first-chat-id'
+            )
+
+        stats = LoadStats()
+        customers = {}
+
+        def on_reply(chat_id, method, text, reply_markup):
+            customer = customers.get(chat_id)
+            if customer and method == 'sendMessage':
+                customer.inbox.put((text, reply_markup))
+
+        state = FakeTelegramState(on_reply)
+        server = start_fake_telegram(state, options['host'], options['port'])
+        api_url = f'http://{options["host"]}:{options["port"]}/bot'
+
+        bot_process = None
+        if options['spawn_bot']:
+            bot_process = subprocess.Popen(
+                [sys.executable, 'manage.py', 'runbot'],
+                env=dict(os.environ, TG_API_URL=api_url),
+            )
+        else:
+            self.stdout.write(f'Start the bot with TG_API_URL={api_url}')
+        try:
+            wait_polling_started(state, bot_process, options['start_timeout'])
+
+            for number in range(options['customers']):
+                chat_id = options['first_chat_id'] + number
+                customers[chat_id] = VirtualCustomer(
+                    chat_id,
+                    state,
+                    stats,
+                    options['reply_timeout'],
+                    options['think_time'],
+                    options['cakes_per_order'],
+                )
+
+            started_at = time.monotonic()
+            with ThreadPoolExecutor(options['concurrency']) as executor:
+                futures = [
+                    executor.submit(customer.run)
+                    for customer in customers.values()
+                ]
+            duration = time.monotonic() - started_at
+            # Исключение в клиенте - ошибка самого теста, а не бота,
+            # и молча занижать по нему статистику нельзя
+            for future in futures:
+                future.result()
+        finally:
+            if bot_process:
+                bot_process.terminate()
+                bot_process.wait()
+            server.shutdown()
+            if not options['keep_data']:
+                deleted_count = delete_load_data(load_clients)
+                self.stdout.write(
+                    f'Deleted {deleted_count} virtual customers '
+                    'with their orders'
+                )
+
+        answered = len(stats.latencies)
+        errors = stats.timeouts + stats.not_understood
+        self.stdout.write(f'Customers: {len(customers)}, '
+                          f'concurrency: {options["concurrency"]}')
+        self.stdout.write(f'Duration: {duration:.1f} s')
+        self.stdout.write(f'Updates sent: {stats.updates_sent}, '
+                          f'answered: {answered}')
+        self.stdout.write(f'Throughput: {answered / duration:.1f} updates/s')
+        self.stdout.write(
+            'Latency p50: {:.0f} ms, p99: {:.0f} ms'.format(
+                get_percentile(stats.latencies, 50) * 1000,
+                get_percentile(stats.latencies, 99) * 1000,
+            )
+        )
+        self.stdout.write(f'Orders confirmed: {stats.orders_confirmed}')
+        self.stdout.write(
+            f'Errors: {errors} ({errors / len(customers):.1%} of customers), '
+            f'timeouts: {stats.timeouts}, not understood: '
+            f'{stats.not_understood}'
+        )
+        self.stdout.write(f'Bot API calls: {state.calls_count}')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from bake_cake_bot.production import format_production_plan
+from bake_cake_bot.production import get_production_plan
+from bake_cake_bot.production import rebuild_production_plan
+
+
+class Command(BaseCommand):
+    help = 'Show option counts needed for orders in progress'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recalculate the plan from orders before showing it',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rebuild_production_plan()
+        plan = get_production_plan()
+        if not plan:
+            self.stdout.write('No orders in progress')
+            return
+        self.stdout.write(format_production_plan(plan))
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+from bake_cake_bot.models import (
+    ArchivedOrder,
+    Client,
+    Order,
+    get_last_order_at,
+)
+
+
+def aggregate_per_client(orders, aggregate):
+    return Coalesce(
+        Subquery(
+            orders.annotate(value=aggregate).values('value'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def rebuild_client_stats(batch_size=1000):
+    # Учитываются и заказы, уже перенесенные в архив
+    confirmed_orders = (
+        Order.objects
+        .filter(client=OuterRef('id'), status__gte=1)
+        .order_by()
+        .values('client')
+    )
+    archived_orders = (
+        ArchivedOrder.objects
+        .filter(client=OuterRef('id'))
+        .order_by()
+        .values('client')
+    )
+    last_id = 0
+    updated_total = 0
+    while True:
+        client_ids = list(
+            Client.objects
+            .filter(id__gt=last_id)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not client_ids:
+            break
+        with transaction.atomic():
+            Client.objects.filter(id__in=client_ids).update(
+                orders_count=(
+                    aggregate_per_client(confirmed_orders, Count('id'))
+                    + aggregate_per_client(archived_orders, Count('id'))
+                ),
+                lifetime_amount=(
+                    aggregate_per_client(confirmed_orders, Sum('total_amount'))
+                    + aggregate_per_client(archived_orders, Sum('total_amount'))
+                ),
+                last_order_at=get_last_order_at(OuterRef('id')),
+            )
+        last_id = client_ids[-1]
+        updated_total += len(client_ids)
+    return updated_total
+
+
+class Command(BaseCommand):
+    help = 'Recalculate order counters of all clients from their orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of clients updated in one transaction',
+        )
+
+    def handle(self, *args, **options):
+        updated_count = rebuild_client_stats(options['batch_size'])
+        self.stdout.write(f'Updated counters of {updated_count} clients')
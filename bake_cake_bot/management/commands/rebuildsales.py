@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from bake_cake_bot.sales import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = 'Rebuild daily sales summaries from confirmed and archived orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of orders aggregated in one pass',
+        )
+
+    def handle(self, *args, **options):
+        days_count, orders_count = rebuild_sales(options['batch_size'])
+        self.stdout.write(
+            f'Summarized {orders_count} orders into {days_count} days'
+        )
@@ -14,32 +14,54 @@ bot.
 """
 
 import logging
+import re
 
-from telegram import Update
+from telegram import Bot, TelegramError, Update
 from telegram import KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
-from telegram.ext import CallbackContext, ConversationHandler
+from telegram.ext import CallbackContext, ConversationHandler, TypeHandler
 
 from django.core.management.base import BaseCommand
 from django.conf import settings
-
-from bake_cake_bot.models import Cake, Category, Client, Order, Option
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F, Prefetch
+from django.utils import timezone
+
+from bake_cake_bot.models import ArchivedCakeOption, ArchivedOrder, Cake
+from bake_cake_bot.models import CakeOption, Category, Client, Option, Order
+from bake_cake_bot.bot_logging import bind_update, configure_logging
+from bake_cake_bot.catalog import OptionCatalog
+from bake_cake_bot.conversations import BoundedConversationHandler
+from bake_cake_bot.cooccurrence import get_cooccurrence_matrix, record_cake
+from bake_cake_bot.cooccurrence import rebuild_cooccurrence_matrix
+from bake_cake_bot.delivery import book_order_slot, clear_order_slot
+from bake_cake_bot.delivery import get_available_days
+from bake_cake_bot.delivery import get_available_slots
+from bake_cake_bot.idempotency import UpdateDeduplicator, run_once
+from bake_cake_bot.previews import CakePreviewRenderer
+from bake_cake_bot.profiling import ProfilingRequest, SlowUpdateProfiler
+from bake_cake_bot.routers import bind_chat, get_read_alias
+from bake_cake_bot.scheduling import PriorityUpdateScheduler
+from bake_cake_bot.sqlite import serialized_write
+from bake_cake_bot.suggestions import build_suggester, get_option_popularity
+from bake_cake_bot.throttling import ChatThrottle
+from bake_cake_bot.sweeper import delete_draft_cakes, delete_draft_orders
+from bake_cake_bot.sweeper import sweep_drafts
+from datetime import timedelta
 from enum import Enum
 from textwrap import dedent
 
 import phonenumbers
 
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
-)
-
 logger = logging.getLogger(__name__)
 
-_option_categories = None
-_category_index = None
-_current_cake_id = None
-_current_order_id = None
+# Состояние сборки торта и заказа хранится у каждого пользователя
+# в context.user_data, там же снимок каталога, по которому собирается торт
+# Рендер превью тортов, создается при запуске бота
+_preview_renderer = None
 
 
 class States(Enum):
@@ -54,8 +76,19 @@ class States(Enum):
     CHANGE_ADDRESS = 8
     CONSENT_PROCESSING = 9
     INPUT_INSCRIPTION = 10
+    CHOOSE_DELIVERY_SLOT = 11
+    INPUT_BUDGET = 12
 
 
+# Состояния, в которых клиент оформляет заказ, обрабатываются в первую очередь
+PRIORITY_STATES = {
+    States.ORDERING,
+    States.CHANGE_PHONE,
+    States.CHANGE_ADDRESS,
+    States.FINISH_CAKE,
+    States.CHOOSE_DELIVERY_SLOT,
+}
+
 def parse_order_id(input_string):
     words = input_string.split(' ')
     order_id = [word for word in words if '№' in word][0]
@@ -68,20 +101,30 @@ def parse_option_id(input_string):
     return int(option_id[1:])
 
 
+def parse_delivery_day(input_string):
+    day_title = input_string.split(' ')[-1]
+    for day in get_available_days():
+        if f'{day:%d.%m}' == day_title:
+            return day
+
+
 # Dialogue keyboards
 def create_main_menu_keyboard(show_orders=False):
     keyboard = [
         [KeyboardButton(text='Собрать торт')],
+        [KeyboardButton(text='Подобрать торт по бюджету')],
     ]
     if show_orders:
         keyboard.append([KeyboardButton(text='Ваши заказы')])
-    logger.info(f'{show_orders} {keyboard}')
+    logger.debug('Main menu keyboard, show orders: %s', show_orders)
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
-def create_orders_keyboard(orders):
+def create_orders_keyboard(orders, is_archive=False):
     keyboard = []
     text_template = 'Заказ №{id} на сумму {total_amount} от {created_at}'
+    if is_archive:
+        text_template = f'Архивный {text_template.lower()}'
     for order in orders:
         keyboard.append(
             [KeyboardButton(text=text_template.format(
@@ -91,14 +134,16 @@ def create_orders_keyboard(orders):
             ))
             ],
         )
+    if not is_archive:
+        keyboard.append([KeyboardButton(text='Архив заказов')])
     keyboard.append(
         [KeyboardButton(text='В главное меню')],
     )
-    logger.info(f'Create orders keyboard {keyboard}')
+    logger.debug('Create orders keyboard with %s rows', len(keyboard))
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
-def create_options_keyboard(category):
+def create_options_keyboard(category, recommended_option_id=None):
     keyboard = []
 
     if not category.is_mandatory:
@@ -107,16 +152,18 @@ def create_options_keyboard(category):
     text_template = '{name} + {price} руб. #{option_id}'
 
     options = category.options.all()
-    logger.info(f'Категория {category}: {options}')
+    logger.debug('Category %s options: %s', category.id, options)
 
     for option in options:
+        option_text = text_template.format(
+            name=option.name,
+            price=option.price,
+            option_id=option.id,
+        )
+        if option.id == recommended_option_id:
+            option_text = f'★ {option_text}'
         keyboard.append(
-            [KeyboardButton(text=text_template.format(
-                name=option.name,
-                price=option.price,
-                option_id=option.id,
-            ))
-            ],
+            [KeyboardButton(text=option_text)],
         )
 
     keyboard.append(
@@ -125,9 +172,30 @@ def create_options_keyboard(category):
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
+def create_suggestions_keyboard(suggestions):
+    keyboard = [
+        [KeyboardButton(text=f'Вариант {number} за {price} руб.')]
+        for number, (price, score, option_ids) in enumerate(
+            suggestions,
+            start=1
+        )
+    ]
+    keyboard.append([KeyboardButton(text='В главное меню')])
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+
+def create_order_details_keyboard(order):
+    keyboard = [
+        [KeyboardButton(text=f'Повторить заказ №{order.id}')],
+        [KeyboardButton(text='В главное меню')],
+    ]
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+
 def create_to_order_keyboard():
     keyboard = [
         [KeyboardButton(text='Оформить заказ')],
+        [KeyboardButton(text='Добавить еще торт')],
         [KeyboardButton(text='В главное меню')]
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -136,6 +204,7 @@ def create_to_order_keyboard():
 def create_order_comfirm_keyboard():
     keyboard = [
         [KeyboardButton(text='Подтвердить заказ')],
+        [KeyboardButton(text='Выбрать время доставки')],
         [KeyboardButton(text='Изменить телефон')],
         [KeyboardButton(text='Изменить адрес')],
         [KeyboardButton(text='Отменить')],
@@ -143,6 +212,29 @@ def create_order_comfirm_keyboard():
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
+def create_delivery_days_keyboard(days):
+    keyboard = [
+        [KeyboardButton(text=f'Доставка {day:%d.%m}')]
+        for day in days
+    ]
+    keyboard.append([KeyboardButton(text='Назад к заказу')])
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+
+def create_delivery_slots_keyboard(slots):
+    keyboard = [
+        [KeyboardButton(
+            text=(
+                f'Время доставки №{slot["id"]} {slot["title"]} '
+                f'(мест: {slot["free"]})'
+            )
+        )]
+        for slot in slots
+    ]
+    keyboard.append([KeyboardButton(text='Назад к заказу')])
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+
 def accept_consent_processing():
     keyboard = [
         [KeyboardButton(text='Принять соглашение')],
@@ -159,28 +251,148 @@ def user_registration():
 
 
 # Function to get or post data to DB
-def create_new_order(cake_id, chat_id):
-    cake = Cake.objects.get(id=cake_id)
-    client = Client.objects.get(tg_chat_id=chat_id)
+@serialized_write
+def create_new_order(cake_ids, chat_id):
+    # Все торты корзины попадают в один заказ. Сумма считается за один
+    # проход по ценам тортов, зафиксированным при сборке, а связи
+    # с тортами вставляются одним запросом.
+    # Повторное оформление той же корзины возвращает уже созданный заказ
+    def create_order():
+        cake_prices = dict(
+            Cake.objects
+            .filter(id__in=cake_ids)
+            .values_list('id', 'price')
+        )
+        if not cake_prices:
+            raise Cake.DoesNotExist(f'Cakes {cake_ids} do not exist')
+        client = Client.objects.get(tg_chat_id=chat_id)
 
-    order = Order.objects.create(
-        client=client,
+        order = Order.objects.create(
+            client=client,
+            total_amount=sum(cake_prices.values()),
+        )
+        OrderCake = Order.cakes.through
+        OrderCake.objects.bulk_create([
+            OrderCake(order_id=order.id, cake_id=cake_id)
+            for cake_id in cake_prices
+        ])
+        Cake.objects.filter(id__in=cake_prices).update(is_in_order=True)
+        return order.id
+
+    return run_once(f'checkout:{chat_id}:{cake_ids[-1]}', create_order)
+
+
+@serialized_write
+def repeat_order(order_id, chat_id):
+    # Копируем заказ вместе с тортами и их параметрами за фиксированное
+    # число запросов: все вставки делаются пачками в одной транзакции
+    source_order = (
+        Order.objects
+        .prefetch_related('cakes__options')
+        .get(id=order_id, client__tg_chat_id=chat_id)
     )
-    order.cakes.set([cake])
-    order.save()
+    source_cakes = list(source_order.cakes.all())
+
+    with transaction.atomic():
+        new_cakes = []
+        for source_cake in source_cakes:
+            new_cakes.append(Cake(
+                created_by_id=source_order.client_id,
+                text=source_cake.text,
+                is_in_order=True,
+                price=sum(
+                    option.price for option in source_cake.options.all()
+                ),
+            ))
+        if connection.features.can_return_rows_from_bulk_insert:
+            Cake.objects.bulk_create(new_cakes)
+        elif connection.vendor == 'sqlite':
+            # SQLite в Django 3.2 не возвращает id после bulk_create.
+            # Вставка держит блокировку записи до конца транзакции, поэтому
+            # последние id тортов - наши, по возрастанию в порядке вставки
+            Cake.objects.bulk_create(new_cakes)
+            new_cake_ids = list(
+                Cake.objects
+                .order_by('-id')
+                .values_list('id', flat=True)[:len(new_cakes)]
+            )
+            for cake, cake_id in zip(new_cakes, reversed(new_cake_ids)):
+                cake.id = cake_id
+        else:
+            # На других базах порядок id не гарантирован, сохраняем по одному
+            for cake in new_cakes:
+                cake.save()
+
+        order = Order.objects.create(
+            client_id=source_order.client_id,
+            total_amount=sum(cake.price for cake in new_cakes),
+        )
+
+        CakeOption.objects.bulk_create([
+            CakeOption(
+                cake_id=new_cake.id,
+                option_id=option.id,
+                price=option.price,
+            )
+            for source_cake, new_cake in zip(source_cakes, new_cakes)
+            for option in source_cake.options.all()
+        ])
+        OrderCake = Order.cakes.through
+        OrderCake.objects.bulk_create([
+            OrderCake(order_id=order.id, cake_id=new_cake.id)
+            for new_cake in new_cakes
+        ])
 
-    cake.is_in_order = True
-    cake.save()
     return order
 
 
+@serialized_write
+def confirm_order(order_id, chat_id):
+    # Повторное подтверждение не должно вернуть статус заказа,
+    # который уже начали готовить
+    def confirm():
+        order = Order.objects.prefetch_related('cakes__options').get(
+            id=order_id
+        )
+        was_confirmed = order.is_confirmed()
+        order.status = 1
+        order.save(update_fields=['status', 'modified_at'])
+        if not was_confirmed:
+            # Матрица сочетаний, как и ее пересборка, учитывает только
+            # подтвержденные заказы и пополняется после фиксации
+            cakes_option_ids = [
+                [option.id for option in cake.options.all()]
+                for cake in order.cakes.all()
+            ]
+
+            def record_cakes():
+                for option_ids in cakes_option_ids:
+                    record_cake(option_ids)
+
+            transaction.on_commit(record_cakes)
+        return order.id
+
+    return run_once(f'confirm:{chat_id}:{order_id}', confirm)
+
+
+@serialized_write
+def book_delivery_slot(order_id, slot_id):
+    return book_order_slot(order_id, slot_id)
+
+
+@serialized_write
+def clear_delivery_slot(order_id):
+    clear_order_slot(order_id)
+
+
+@serialized_write
 def get_client_entry(chat_id, tg_user):
     client, is_new = Client.objects.get_or_create(tg_chat_id=chat_id)
-    logger.info(f'Get client from DB: {client}, {is_new}')
+    logger.info('Get client %s from DB, is new: %s', chat_id, is_new)
 
     if is_new:
         client.first_name = tg_user.first_name
-        logger.info(f'Last name: {tg_user.last_name}, {bool(tg_user.last_name)}')
+        logger.debug('Last name: %s', tg_user.last_name)
         if tg_user.last_name:
             client.last_name = tg_user.last_name
         client.save()
@@ -188,6 +400,7 @@ def get_client_entry(chat_id, tg_user):
     return client
 
 
+@serialized_write
 def add_consent_processing(chat_id, consest):
     client, is_new = Client.objects.get_or_create(tg_chat_id=chat_id)
     client.pd_proccessing_consent = consest
@@ -195,6 +408,7 @@ def add_consent_processing(chat_id, consest):
     return client
 
 
+@serialized_write
 def add_phone_to_client(chat_id, phone):
     client, is_new = Client.objects.get_or_create(tg_chat_id=chat_id)
     client.phone = phone
@@ -202,6 +416,7 @@ def add_phone_to_client(chat_id, phone):
     return client
 
 
+@serialized_write
 def add_address_to_client(chat_id, address):
     client, is_new = Client.objects.get_or_create(tg_chat_id=chat_id)
     client.address = address
@@ -210,26 +425,124 @@ def add_address_to_client(chat_id, address):
 
 
 def get_client_orders(chat_id):
-    client = Client.objects.get(tg_chat_id=chat_id)
-    orders = client.orders.all()
-    logger.info(f'Get orders: {orders}')
+    orders = (
+        Order.objects
+        .using(get_read_alias())
+        .filter(client__tg_chat_id=chat_id)
+    )
+    logger.info('Get orders for client %s', chat_id)
     return orders
 
 
 def get_order_details(order_id):
     order = (
         Order.objects
-        .select_related('client')
-        .prefetch_related('cakes')
+        .using(get_read_alias())
+        .select_related('client', 'delivery_slot')
         .get(id=order_id)
     )
     return order
 
 
+def get_order_composition(order):
+    # Текст кешируется до следующего изменения заказа: правка торта
+    # в админке тоже сдвигает дату изменения его заказов
+    cache_key = (
+        f'order_composition:{order.id}:{order.modified_at.timestamp()}'
+    )
+    composition = cache.get(cache_key)
+    if composition is not None:
+        return composition
+
+    cakes = (
+        order.cakes
+        .prefetch_related(Prefetch(
+            'options',
+            queryset=(
+                Option.objects
+                .select_related('category')
+                .order_by('category__choice_order')
+            )
+        ))
+        .order_by('id')
+    )
+    composition = format_cakes([
+        (
+            cake.price,
+            [(option.category.title, option.name)
+             for option in cake.options.all()],
+            cake.text,
+        )
+        for cake in cakes
+    ])
+    cache.set(cache_key, composition, timeout=24 * 60 * 60)
+    return composition
+
+
+def format_cakes(cakes):
+    cakes_texts = []
+    for number, (price, options, text) in enumerate(cakes, start=1):
+        cake_lines = [f'Торт {number}, цена {price} руб.']
+        for category_title, option_name in options:
+            cake_lines.append(f'  {category_title}: {option_name}')
+        if text:
+            cake_lines.append(f'  Текст надписи: "{text}"')
+        cakes_texts.append('\n'.join(cake_lines))
+    return '\n\n'.join(cakes_texts)
+
+
+def get_client_archived_orders(chat_id):
+    return (
+        ArchivedOrder.objects
+        .using(get_read_alias())
+        .filter(client__tg_chat_id=chat_id)
+        .order_by('-created_at')
+    )
+
+
+def get_archived_order_composition(order_id, chat_id):
+    order = (
+        ArchivedOrder.objects
+        .using(get_read_alias())
+        .prefetch_related(Prefetch(
+            'cakes__cake_options',
+            queryset=ArchivedCakeOption.objects.order_by(
+                'category_choice_order'
+            )
+        ))
+        .get(id=order_id, client__tg_chat_id=chat_id)
+    )
+    composition = format_cakes([
+        (
+            cake.price,
+            [(cake_option.category_title, cake_option.option_name)
+             for cake_option in cake.cake_options.all()],
+            cake.text,
+        )
+        for cake in order.cakes.all()
+    ])
+    return order, composition
+
+
+def start_catalog_snapshot(context):
+    # Новый торт собирается по свежему каталогу, а начатый - по снимку,
+    # с которым начат: админка может менять категории посреди сборки,
+    # а индекс категории в user_data указывает в этот снимок
+    catalog = OptionCatalog(load_categories())
+    context.user_data['catalog'] = catalog
+    return catalog
+
+
 def load_categories():
-    return Category.objects.prefetch_related('options').order_by('choice_order')
+    return (
+        Category.objects
+        .using(get_read_alias())
+        .prefetch_related('options')
+        .order_by('choice_order')
+    )
 
 
+@serialized_write
 def create_new_cake(chat_id):
     cake = Cake.objects.create(
         created_by=Client.objects.get(tg_chat_id=chat_id),
@@ -237,32 +550,58 @@ def create_new_cake(chat_id):
     return cake.id
 
 
+@serialized_write
 def add_option_to_cake(option_id, cake_id):
-    cake = Cake.objects.get(id=cake_id)
+    # Цена параметра фиксируется в момент выбора,
+    # стоимость торта наращивается без пересчета всех параметров
     option = Option.objects.get(id=option_id)
-    cake.options.add(option)
-    cake.save()
+    cake_option, is_new = CakeOption.objects.get_or_create(
+        cake_id=cake_id,
+        option=option,
+        defaults={'price': option.price},
+    )
+    if is_new:
+        Cake.objects.filter(id=cake_id).update(
+            price=F('price') + cake_option.price
+        )
+    return cake_option, is_new
+
+
+@serialized_write
+def create_cake_with_options(chat_id, option_ids):
+    options = list(Option.objects.filter(id__in=option_ids))
+    with transaction.atomic():
+        cake = Cake.objects.create(
+            created_by=Client.objects.get(tg_chat_id=chat_id),
+            price=sum(option.price for option in options),
+        )
+        CakeOption.objects.bulk_create([
+            CakeOption(cake=cake, option=option, price=option.price)
+            for option in options
+        ])
     return cake
 
 
+@serialized_write
 def delete_cake(cake_id):
     Cake.objects.get(id=cake_id).delete()
     return
 
 
+@serialized_write
 def add_inscription_to_cake(cake_id, text):
     cake = Cake.objects.get(id=cake_id)
     cake.text = text
-    cake.save()
+    cake.save(update_fields=['text'])
     return cake
 
 
 def check_with_inscription(cake_id):
     cake = Cake.objects.prefetch_related('options').get(id=cake_id)
     inscription = Option.objects.filter(name__contains='надпись').first()
-    logger.info(f'Find option with inscription: {inscription}')
-    logger.info(f'Cake includes inscription: {inscription in cake.options.all()}')
-    return (inscription in cake.options.all())
+    has_inscription = inscription in cake.options.all()
+    logger.info('Cake %s includes inscription: %s', cake_id, has_inscription)
+    return has_inscription
 
 
 # Functions to send user standard messages
@@ -295,8 +634,8 @@ def request_for_input_address(update):
 
 def invite_user_to_main_menu(update):
     client = Client.objects.get(tg_chat_id=update.message.chat_id)
-    is_any_order = client.orders.exists()
-    logger.info(f'CLient {client} has orders? {is_any_order}')
+    is_any_order = client.orders_count > 0
+    logger.info('Client %s has orders: %s', client.tg_chat_id, is_any_order)
     update.message.reply_text(
         text='Выберите действие',
         reply_markup=create_main_menu_keyboard(is_any_order)
@@ -304,60 +643,78 @@ def invite_user_to_main_menu(update):
     return States.CLIENT_MAIN_MENU
 
 
-def send_option_choices(update, category):
+def send_option_choices(update, context):
+    # Цены считаются по каталогу в памяти, без запросов к базе
+    category_index = context.user_data['category_index']
+    cake_price = context.user_data['cake_price']
+    catalog = context.user_data['catalog']
+    min_price, max_price = catalog.get_price_range(cake_price, category_index)
+    category = catalog[category_index]
+    recommended_option_id = get_cooccurrence_matrix().recommend(
+        context.user_data['option_ids'],
+        [option.id for option in category.options.all()]
+    )
+    text = dedent(f'''\
+        Сейчас торт стоит {cake_price} руб.
+        Готовый торт обойдется от {min_price} до {max_price} руб.
+
+        Выберите вариант "{category.title}"''')
+    if recommended_option_id:
+        text += '\n★ - часто выбирают вместе с вашим выбором'
     update.message.reply_text(
-        text=f'Выберите вариант "{category.title}"',
-        reply_markup=create_options_keyboard(category)
+        text=text,
+        reply_markup=create_options_keyboard(category, recommended_option_id)
     )
     return
 
 
-def get_next_category(update, category_number):
-    global _current_cake_id
-    global _category_index
-    _category_index += 1
+def get_next_category(update, context):
+    category_index = context.user_data['category_index'] + 1
+    context.user_data['category_index'] = category_index
 
-    logger.info(f'Next {_category_index}/{len(_option_categories)}')
+    catalog = context.user_data['catalog']
+    logger.info('Next category %s/%s', category_index, len(catalog))
 
-    if _category_index >= len(_option_categories):
-        return invite_to_ordering(update)
+    if category_index >= len(catalog):
+        return invite_to_ordering(update, context)
 
-    send_option_choices(update, _option_categories[_category_index])
+    send_option_choices(update, context)
     return States.CREATE_CAKE
 
 
-def invite_to_ordering(update):
-    global _category_index
-    global _current_cake_id
-
-    _category_index = None
+def invite_to_ordering(update, context):
+    context.user_data['category_index'] = None
     logger.info('Options has been chosen')
 
-    if check_with_inscription(_current_cake_id):
+    if check_with_inscription(context.user_data['cake_id']):
         update.message.reply_text('Введите надпись для торта')
         return States.INPUT_INSCRIPTION
     
-    send_finish_cake(update)
+    send_finish_cake(update, context)
     return States.FINISH_CAKE
 
 
 def send_order_info(update, order):
     orders_states = dict(order.get_order_states())
-    logger.info(f'States {orders_states}')
-    update.message.reply_text(dedent(f'''\
+    order_header = dedent(f'''\
         Заказ №{order.id}
         Статус заказа: {orders_states[order.status]}
-
-        Количество тортов в заказе: {order.cakes.count()}
-        Стоимость заказа: {order.total_amount}
-
+        Стоимость заказа: {order.total_amount}''')
+    recipient_info = dedent(f'''\
         Имя получателя: {order.client.first_name} {order.client.last_name}
         Телефон: {order.client.phone}
-        Адрес доставки: {order.client.address}'''))
+        Адрес доставки: {order.client.address}
+        Время доставки: {order.delivery_slot or 'не выбрано'}''')
+    update.message.reply_text('\n\n'.join([
+        order_header,
+        get_order_composition(order),
+        recipient_info,
+    ]))
     return
 
 
-def invite_to_confirm_order(update, order):
+def invite_to_confirm_order(update, order_id):
+    order = get_order_details(order_id)
     send_order_info(update, order)
     update.message.reply_text(
         text='Проверьте свой заказ',
@@ -366,29 +723,40 @@ def invite_to_confirm_order(update, order):
     return
 
 
-# States handlers
-def handle_stop(update, context):
-    global _current_cake_id
-    global _category_index
-    global _current_order_id
+def invite_to_choose_delivery_day(update, text='Выберите день доставки'):
+    days = get_available_days()
+    if not days:
+        return None
+    update.message.reply_text(
+        text=text,
+        reply_markup=create_delivery_days_keyboard(days)
+    )
+    return States.CHOOSE_DELIVERY_SLOT
 
-    _current_cake_id = None
-    _category_index = None
-    _current_order_id = None
 
+# States handlers
+def handle_stop(update, context):
+    context.user_data.clear()
     return ConversationHandler.END
 
 
 def handle_return_to_menu(update, context):
-    global _category_index
-    global _current_cake_id
-
-    logger.info(f'Delete cake {_current_cake_id}')
-    if _current_cake_id:
-        logger.info(f'Delete cake {_current_cake_id}')
-        delete_cake(_current_cake_id)
-    _category_index = None
-    _current_cake_id = None
+    cake_id = context.user_data.pop('cake_id', None)
+    if cake_id:
+        logger.info('Delete cake %s', cake_id)
+        delete_cake(cake_id)
+    cart = context.user_data.pop('cart', None)
+    context.user_data.pop('cart_price', None)
+    if cart:
+        logger.info('Delete cart cakes %s', cart)
+        delete_draft_cakes(cart)
+    # Неподтвержденный заказ не должен держать слот доставки до очистки
+    order_id = context.user_data.pop('order_id', None)
+    if order_id:
+        logger.info('Delete draft order %s', order_id)
+        delete_draft_orders([order_id])
+    context.user_data['category_index'] = None
+    context.user_data.pop('catalog', None)
 
     return invite_user_to_main_menu(update)
 
@@ -452,14 +820,14 @@ def handle_phone_input(update, context):
     update.message.reply_text(
         f'В профиль добавлен телефон для связи: {client.phone}',
     )
-    logger.info(f'Add phone {client.phone} for {client.tg_chat_id}')
+    logger.info('Add phone for %s', client.tg_chat_id)
 
     return handle_authorization(update, context)
 
 
 def handle_address_input(update, context):
     client = add_address_to_client(update.message.chat_id, update.message.text)
-    logger.info(f'Add address {client.address} for {client.tg_chat_id}')
+    logger.info('Add address for %s', client.tg_chat_id)
     update.message.reply_text(
         f'В профиль добавлен адрес доставки: {client.address}',
     )
@@ -481,85 +849,332 @@ def handle_show_orders(update, context):
 
 def handle_order_details(update, context):
     order_id = parse_order_id(update.message.text)
-    logger.info(f'Parse order id: {order_id}')
+    logger.info('Parse order id: %s', order_id)
     order = get_order_details(order_id)
 
     send_order_info(update, order)
+    update.message.reply_text(
+        text='Можно повторить этот заказ',
+        reply_markup=create_order_details_keyboard(order)
+    )
     return States.ORDER_DETAILS
 
 
-def handle_create_cake(update, context):
-    global _option_categories
-    global _category_index
-    global _current_cake_id
+def handle_show_archived_orders(update, context):
+    orders = list(get_client_archived_orders(update.message.chat_id))
+    if not orders:
+        update.message.reply_text('В архиве нет заказов')
+        return States.ORDER_DETAILS
+
+    update.message.reply_text(
+        'Выберите заказ из архива',
+        reply_markup=create_orders_keyboard(orders, is_archive=True)
+    )
+    return States.ORDER_DETAILS
+
 
-    if _category_index is None:
+def handle_archived_order_details(update, context):
+    order_id = parse_order_id(update.message.text)
+    order, composition = get_archived_order_composition(
+        order_id,
+        update.message.chat_id
+    )
+    update.message.reply_text('\n\n'.join([
+        dedent(f'''\
+            Заказ №{order.id}
+            Статус заказа: Завершен
+            Стоимость заказа: {order.total_amount}'''),
+        composition,
+    ]))
+    return States.ORDER_DETAILS
+
+
+def handle_repeat_order(update, context):
+    order_id = parse_order_id(update.message.text)
+    try:
+        order = repeat_order(order_id, update.message.chat_id)
+    except Order.DoesNotExist:
+        orders = get_client_orders(update.message.chat_id)
+        update.message.reply_text(
+            'Заказ не найден, выберите заказ из списка',
+            reply_markup=create_orders_keyboard(orders)
+        )
+        return States.ORDER_DETAILS
+    logger.info('Repeat order %s as %s', order_id, order.id)
+
+    invite_to_confirm_order(update, order.id)
+
+    context.user_data['order_id'] = order.id
+    return States.ORDERING
+
+
+def handle_create_cake(update, context):
+    if context.user_data.get('category_index') is None:
         # Подгружаем категории и создаем клавиатуру
-        _option_categories = list(load_categories())
-        print(_option_categories)
-        _category_index = 0
-        _current_cake_id = create_new_cake(update.message.chat_id)
-        send_option_choices(update, _option_categories[_category_index])
-        logger.info(f'Send {_category_index}/{len(_option_categories)}')
+        catalog = start_catalog_snapshot(context)
+        context.user_data['category_index'] = 0
+        context.user_data['cake_price'] = 0
+        context.user_data['option_ids'] = []
+        context.user_data['cake_id'] = create_new_cake(update.message.chat_id)
+        send_option_choices(update, context)
+        logger.info('Send category %s/%s', 0, len(catalog))
         return States.CREATE_CAKE
 
+    cake_id = context.user_data['cake_id']
     option_id = parse_option_id(update.message.text)
-    add_option_to_cake(option_id, _current_cake_id)
-    logger.info(f'Add option {option_id} to cake {_current_cake_id}')
+    catalog = context.user_data['catalog']
+    category = catalog[context.user_data['category_index']]
+    if option_id not in [option.id for option in category.options.all()]:
+        # Кнопка со старой клавиатуры или из другой категории
+        logger.info('Option %s is not in category %s', option_id, category)
+        send_option_choices(update, context)
+        return States.CREATE_CAKE
+
+    cake_option, is_new = add_option_to_cake(option_id, cake_id)
+    if is_new:
+        # Повторное нажатие не должно второй раз прибавлять цену
+        context.user_data['cake_price'] += cake_option.price
+        context.user_data['option_ids'].append(option_id)
+    logger.info('Add option %s to cake %s', option_id, cake_id)
 
-    return get_next_category(update, len(_option_categories))
+    return get_next_category(update, context)
+
+
+def handle_request_budget(update, context):
+    start_catalog_snapshot(context)
+    update.message.reply_text(
+        text='Введите бюджет на торт в рублях',
+        reply_markup=ReplyKeyboardRemove()
+    )
+    return States.INPUT_BUDGET
+
+
+def handle_budget_input(update, context):
+    budget = re.sub(r'\D', '', update.message.text)
+    if not budget:
+        update.message.reply_text('Введите бюджет числом, например 2000')
+        return States.INPUT_BUDGET
+
+    budget = int(budget)
+    catalog = context.user_data['catalog']
+    suggester = build_suggester(catalog, get_option_popularity())
+    suggestions = suggester.suggest(budget, settings.BUDGET_SUGGESTIONS_COUNT)
+    logger.info('Found %s cakes for budget %s', len(suggestions), budget)
+    if not suggestions:
+        if suggester.min_price is None:
+            update.message.reply_text('Сейчас торт по бюджету не подобрать')
+            return invite_user_to_main_menu(update)
+        update.message.reply_text(
+            f'Введите бюджет не меньше {suggester.min_price} руб., '
+            'дешевле торт не собрать'
+        )
+        return States.INPUT_BUDGET
+
+    context.user_data['suggestions'] = [
+        option_ids for price, score, option_ids in suggestions
+    ]
+    suggestions_texts = []
+    for number, (price, score, option_ids) in enumerate(suggestions, 1):
+        suggestion_lines = [f'Вариант {number}, цена {price} руб.']
+        for option_id in option_ids:
+            category_title, option_name = catalog.option_titles[option_id]
+            suggestion_lines.append(f'  {category_title}: {option_name}')
+        suggestions_texts.append('\n'.join(suggestion_lines))
+    update.message.reply_text(
+        text='\n\n'.join(suggestions_texts),
+        reply_markup=create_suggestions_keyboard(suggestions)
+    )
+    return States.INPUT_BUDGET
+
+
+def handle_choose_suggestion(update, context):
+    number = int(update.message.text.split(' ')[1])
+    suggestions = context.user_data.pop('suggestions', [])
+    if number > len(suggestions):
+        return handle_request_budget(update, context)
+
+    option_ids = suggestions[number - 1]
+    cake = create_cake_with_options(update.message.chat_id, option_ids)
+    logger.info('Create cake %s from budget suggestion', cake.id)
+
+    context.user_data['cake_id'] = cake.id
+    context.user_data['cake_price'] = cake.price
+    context.user_data['option_ids'] = option_ids
+    return invite_to_ordering(update, context)
 
 
 def handle_skip_option(update, context):
-    global _option_categories
-    return get_next_category(update, len(_option_categories))
+    return get_next_category(update, context)
+
+
+def send_cake_preview(update, context, inscription=''):
+    # Превью рендерится и отправляется в потоке диспетчера,
+    # сообщение о готовом торте не ждет его
+    catalog = context.user_data.get('catalog')
+    if not _preview_renderer or not catalog:
+        return
+    layer_names = catalog.get_layers(context.user_data.get('option_ids', []))
+    if not layer_names:
+        return
+    context.dispatcher.run_async(
+        _preview_renderer.send,
+        context.bot,
+        update.message.chat_id,
+        layer_names,
+        inscription,
+    )
 
 
-def send_finish_cake(update):
+def send_finish_cake(update, context, inscription=''):
+    send_cake_preview(update, context, inscription)
+    text = dedent(f'''\
+        Торт собран! Можно переходить к оформлению заказа
+        Стоимость торта: {context.user_data['cake_price']} руб.''')
+    cart = context.user_data.get('cart')
+    if cart:
+        cart_price = context.user_data['cart_price']
+        text += (
+            f'\nВ корзине еще тортов: {len(cart)}, '
+            f'весь заказ: {cart_price + context.user_data["cake_price"]} руб.'
+        )
     update.message.reply_text(
-        text='Торт собран! Можно переходить к оформлению заказа',
+        text=text,
         reply_markup=create_to_order_keyboard()
     )
     return States.FINISH_CAKE
 
 
 def handle_add_inscription(update, context):
-    global _current_cake_id  
-    logger.info(f'Get cake inscription text: {update.message.text}')
-    cake = add_inscription_to_cake(_current_cake_id, update.message.text)
+    logger.debug('Get cake inscription text: %s', update.message.text)
+    cake = add_inscription_to_cake(
+        context.user_data['cake_id'],
+        update.message.text
+    )
     update.message.reply_text(
         text=f'Добавлена надпись на торте: "{cake.text}"',
     )    
-    return send_finish_cake(update)
+    return send_finish_cake(update, context, cake.text)
 
 
-def handle_create_order(update, context):
-    global _current_cake_id
-    global _current_order_id
+def handle_add_cake_to_cart(update, context):
+    # Собранный торт откладывается в корзину, клиент собирает следующий
+    cart = context.user_data.setdefault('cart', [])
+    cart.append(context.user_data.pop('cake_id'))
+    context.user_data['cart_price'] = (
+        context.user_data.get('cart_price', 0)
+        + context.user_data.pop('cake_price', 0)
+    )
+    context.user_data.pop('option_ids', None)
+    logger.info('Add cake %s to cart', cart[-1])
 
-    order = create_new_order(_current_cake_id, update.message.chat_id)
-    _current_cake_id = None
+    update.message.reply_text(
+        text=(
+            f'Торт добавлен в корзину, в ней тортов: {len(cart)} '
+            f'на {context.user_data["cart_price"]} руб. '
+            'Соберите следующий торт'
+        ),
+    )
+    context.user_data['category_index'] = None
+    return handle_create_cake(update, context)
 
-    invite_to_confirm_order(update, order)
 
-    _current_order_id = order.id
+def handle_create_order(update, context):
+    # Корзина очищается только после создания заказа: повторно
+    # доставленное нажатие найдет тот же ключ и тот же заказ
+    cake_id = context.user_data.get('cake_id')
+    if cake_id is None:
+        # Заказ по этой корзине уже создан
+        return handle_return_to_order(update, context)
+    cake_ids = [*context.user_data.get('cart', []), cake_id]
+    order_id = create_new_order(cake_ids, update.message.chat_id)
+    for key in ('cart', 'cake_id', 'cake_price', 'cart_price', 'catalog'):
+        context.user_data.pop(key, None)
+    context.user_data.pop('option_ids', None)
+
+    invite_to_confirm_order(update, order_id)
+
+    context.user_data['order_id'] = order_id
     return States.ORDERING
 
 
 def handle_confirm_order(update, context):
-    global _current_order_id
-
-    order = Order.objects.get(id=_current_order_id)
-    order.status = 1
-    order.save()
+    order = get_order_details(context.user_data['order_id'])
+    text = 'Выберите день доставки, чтобы оформить заказ'
+    slot = order.delivery_slot
+    if slot and slot.starts_at <= timezone.now():
+        # Слот бронировался на будущее, но клиент подтверждает позже
+        logger.info('Delivery slot %s of order %s has passed', slot.id,
+                    order.id)
+        clear_delivery_slot(order.id)
+        text = 'Выбранное время доставки уже прошло, выберите другое'
+        slot = None
+    if not slot:
+        next_state = invite_to_choose_delivery_day(update, text=text)
+        if next_state:
+            return next_state
+
+    order_id = context.user_data.pop('order_id')
+    confirm_order(order_id, update.message.chat_id)
 
     update.message.reply_text(
-        text=f'Заказ № {_current_order_id} подтвержден'
+        text=f'Заказ № {order_id} подтвержден'
     )
-    _current_order_id = None
     return invite_user_to_main_menu(update)
 
 
+def handle_choose_delivery(update, context):
+    next_state = invite_to_choose_delivery_day(update)
+    if next_state:
+        return next_state
+
+    update.message.reply_text(
+        text='Свободного времени доставки нет, мы согласуем его по телефону'
+    )
+    invite_to_confirm_order(update, context.user_data['order_id'])
+    return States.ORDERING
+
+
+def handle_delivery_day(update, context):
+    day = parse_delivery_day(update.message.text)
+    slots = get_available_slots(day) if day else []
+    if not slots:
+        return (
+            invite_to_choose_delivery_day(
+                update,
+                text='На этот день свободного времени нет, выберите другой'
+            )
+            or handle_choose_delivery(update, context)
+        )
+
+    update.message.reply_text(
+        text='Выберите время доставки',
+        reply_markup=create_delivery_slots_keyboard(slots)
+    )
+    return States.CHOOSE_DELIVERY_SLOT
+
+
+def handle_book_delivery_slot(update, context):
+    slot_id = parse_order_id(update.message.text)
+    slot = book_delivery_slot(context.user_data['order_id'], slot_id)
+    if not slot:
+        return (
+            invite_to_choose_delivery_day(
+                update,
+                text='Это время уже занято, выберите другое'
+            )
+            or handle_choose_delivery(update, context)
+        )
+
+    logger.info('Book delivery slot %s', slot_id)
+    invite_to_confirm_order(update, context.user_data['order_id'])
+    return States.ORDERING
+
+
+def handle_return_to_order(update, context):
+    invite_to_confirm_order(update, context.user_data['order_id'])
+    return States.ORDERING
+
+
 def handle_request_other_address(update, context):
     update.message.reply_text(
         text='Введите адрес доставки'
@@ -575,8 +1190,6 @@ def handle_request_other_phone(update, context):
 
 
 def handle_phone_change(update, context):
-    global _current_order_id
-
     input_phone_number = update.message.text
     if not phonenumbers.is_valid_number(
         phonenumbers.parse(
@@ -594,10 +1207,9 @@ def handle_phone_change(update, context):
     update.message.reply_text(
         f'В профиль добавлен телефон для связи: {client.phone}',
     )
-    logger.info(f'Add phone {client.phone} for {client.tg_chat_id}')
+    logger.info('Add phone for %s', client.tg_chat_id)
 
-    order = Order.objects.get(id=_current_order_id)
-    invite_to_confirm_order(update, order)
+    invite_to_confirm_order(update, context.user_data['order_id'])
     return States.ORDERING
 
 
@@ -607,22 +1219,15 @@ def handle_address_change(update, context):
     update.message.reply_text(
         f'В профиль добавлен адрес доставки: {client.address}',
     )
-    logger.info(f'Add address {client.address} for {client.tg_chat_id}')
+    logger.info('Add address for %s', client.tg_chat_id)
 
-    order = Order.objects.get(id=_current_order_id)
-    invite_to_confirm_order(update, order)
+    invite_to_confirm_order(update, context.user_data['order_id'])
     return States.ORDERING
 
 
 def start(update, context):
-    global _current_cake_id
-    global _category_index
-    global _current_order_id
+    context.user_data.clear()
 
-    _current_cake_id = None
-    _category_index = None
-    _current_order_id = None
-    
     user = update.effective_user
     update.message.reply_text(
         text=f'Привет, {user.first_name}!',
@@ -637,6 +1242,13 @@ def handle_not_understand(update, context):
     )
 
 
+def handle_expired_conversation(update, context):
+    # Разговора нет: он завершился по бездействию или бот перезапущен
+    update.message.reply_text(
+        text='Давно не виделись! Чтобы продолжить, нажмите /start',
+    )
+
+
 def help_command(update, context) -> None:
     update.message.reply_text('Help!')
 
@@ -645,12 +1257,99 @@ def echo(update: Update, context: CallbackContext) -> None:
     update.message.reply_text(update.message.text)
 
 
-def run_bot(tg_token) -> None:
-    updater = Updater(tg_token)
+def end_conversation(dispatcher, key):
+    # Завершенный по бездействию разговор не должен держать ни данные
+    # пользователя в памяти, ни торты корзины и недособранный торт,
+    # ни неподтвержденный заказ со слотом доставки
+    chat_id, user_id = key
+    user_data = dispatcher.user_data.pop(user_id, None) or {}
+    dispatcher.chat_data.pop(chat_id, None)
+    cake_ids = list(user_data.get('cart', []))
+    if user_data.get('cake_id'):
+        cake_ids.append(user_data['cake_id'])
+    if cake_ids:
+        delete_draft_cakes(cake_ids)
+    if user_data.get('order_id'):
+        delete_draft_orders([user_data['order_id']])
+
+
+def expire_conversations_job(context):
+    context.job.context.expire_idle()
+
+
+def sweep_drafts_job(context):
+    # Пачки очистки записываются под serialized_write, как и удаление
+    # черновиков при завершении разговора в expire_conversations_job
+    sweep_drafts(settings.DRAFTS_MAX_AGE_HOURS)
+
+
+def rebuild_cooccurrence_job(context):
+    rebuild_cooccurrence_matrix()
+
+
+@serialized_write
+def flush_processed_updates_job(context):
+    context.job.context.flush()
+
+
+def log_bot_stats(context):
+    for name, counters in context.job.context.items():
+        logger.info('%s stats: %s', name, counters.get_stats())
+
+
+def get_update_priority(conv_handler, update):
+    key = (update.effective_chat.id, update.effective_user.id)
+    state = conv_handler.conversations.get(key)
+    if state in PRIORITY_STATES:
+        return 0
+    if state is None:
+        return 2
+    return 1
+
+
+def reply_overloaded(update):
+    try:
+        update.effective_message.reply_text(
+            'Сейчас очень много запросов, повторите, пожалуйста, позже'
+        )
+    except TelegramError:
+        logger.exception('Can not reply to shed update %s', update.update_id)
+
+
+def run_bot(tg_token, base_url=None) -> None:
+    global _preview_renderer
+
+    # Updater требует пул соединений не меньше числа своих воркеров + 4,
+    # еще по соединению нужно каждому потоку планировщика
+    con_pool_size = 8 + settings.BOT_WORKERS
+    profiler = None
+    if settings.SLOW_UPDATE_THRESHOLD_MS:
+        profiler = SlowUpdateProfiler(
+            settings.SLOW_UPDATE_THRESHOLD_MS,
+            settings.SLOW_UPDATE_PROFILE_DIR,
+            settings.SLOW_UPDATE_PROFILES_KEEP,
+        )
+        bot = Bot(
+            tg_token,
+            base_url=base_url,
+            request=ProfilingRequest(con_pool_size=con_pool_size),
+        )
+        updater = Updater(bot=bot)
+    else:
+        updater = Updater(
+            tg_token,
+            base_url=base_url,
+            request_kwargs={'con_pool_size': con_pool_size},
+        )
 
     dispatcher = updater.dispatcher
+    dispatcher.add_handler(TypeHandler(Update, bind_chat), group=-3)
+    dispatcher.add_handler(TypeHandler(Update, bind_update), group=-1)
 
-    conv_handler = ConversationHandler(
+    conv_handler = BoundedConversationHandler(
+        idle_timeout=settings.CONVERSATION_IDLE_TIMEOUT,
+        max_conversations=settings.MAX_CONVERSATIONS,
+        on_expire=lambda key: end_conversation(dispatcher, key),
         entry_points=[CommandHandler('start', start)],
         states={
             States.CONSENT_PROCESSING: [
@@ -680,6 +1379,24 @@ def run_bot(tg_token) -> None:
                     Filters.regex('^Собрать торт$'),
                     handle_create_cake
                 ),
+                MessageHandler(
+                    Filters.regex('^Подобрать торт по бюджету$'),
+                    handle_request_budget
+                ),
+            ],
+            States.INPUT_BUDGET: [
+                MessageHandler(
+                    Filters.regex('^В главное меню$'),
+                    handle_return_to_menu,
+                ),
+                MessageHandler(
+                    Filters.regex(r'^Вариант \d+ за'),
+                    handle_choose_suggestion,
+                ),
+                MessageHandler(
+                    Filters.text & ~Filters.command,
+                    handle_budget_input
+                ),
             ],
             States.CREATE_CAKE: [
                 MessageHandler(
@@ -710,12 +1427,24 @@ def run_bot(tg_token) -> None:
                     Filters.regex('^Оформить заказ$'),
                     handle_create_order,
                 ),
+                MessageHandler(
+                    Filters.regex('^Добавить еще торт$'),
+                    handle_add_cake_to_cart,
+                ),
             ],
             States.ORDERING: [
                 MessageHandler(
                     Filters.regex('^Подтвердить заказ$'),
                     handle_confirm_order,
                 ),
+                MessageHandler(
+                    Filters.regex('^Оформить заказ$'),
+                    handle_return_to_order,
+                ),
+                MessageHandler(
+                    Filters.regex('^Выбрать время доставки$'),
+                    handle_choose_delivery,
+                ),
                 MessageHandler(
                     Filters.regex('^Изменить адрес$'),
                     handle_request_other_address,
@@ -729,6 +1458,20 @@ def run_bot(tg_token) -> None:
                     handle_return_to_menu,
                 ),
             ],
+            States.CHOOSE_DELIVERY_SLOT: [
+                MessageHandler(
+                    Filters.regex('^Доставка '),
+                    handle_delivery_day,
+                ),
+                MessageHandler(
+                    Filters.regex('^Время доставки №'),
+                    handle_book_delivery_slot,
+                ),
+                MessageHandler(
+                    Filters.regex('^Назад к заказу$'),
+                    handle_return_to_order,
+                ),
+            ],
             States.CHANGE_PHONE: [
                 MessageHandler(
                     Filters.text & ~Filters.command,
@@ -750,6 +1493,18 @@ def run_bot(tg_token) -> None:
                     Filters.regex('^Заказ №*'),
                     handle_order_details,
                 ),
+                MessageHandler(
+                    Filters.regex('^Повторить заказ №'),
+                    handle_repeat_order,
+                ),
+                MessageHandler(
+                    Filters.regex('^Архив заказов$'),
+                    handle_show_archived_orders,
+                ),
+                MessageHandler(
+                    Filters.regex('^Архивный заказ №'),
+                    handle_archived_order_details,
+                ),
             ]
         },
         fallbacks=[
@@ -763,15 +1518,116 @@ def run_bot(tg_token) -> None:
     )
 
     dispatcher.add_handler(conv_handler)
+    dispatcher.add_handler(
+        MessageHandler(
+            Filters.text & ~Filters.command,
+            handle_expired_conversation
+        )
+    )
 
     dispatcher.add_handler(CommandHandler("help", help_command))
 
+    if profiler:
+        profiler.register(dispatcher, conv_handler)
+
+    scheduler = PriorityUpdateScheduler(
+        dispatcher.process_update,
+        lambda update: get_update_priority(conv_handler, update),
+        workers=settings.BOT_WORKERS,
+        max_queue_size=settings.BOT_UPDATE_QUEUE_SIZE,
+        on_overload=reply_overloaded,
+    )
+    dispatcher.add_handler(TypeHandler(Update, scheduler.schedule), group=-10)
+    scheduler.start()
+    bot_stats = {'Scheduler': scheduler}
+
+    deduplicator = UpdateDeduplicator(
+        settings.IDEMPOTENCY_CACHE_SIZE,
+        timedelta(hours=settings.IDEMPOTENCY_RETENTION_HOURS),
+    )
+    deduplicator.load()
+    dispatcher.add_handler(
+        TypeHandler(Update, deduplicator.check_update),
+        group=-30
+    )
+    dispatcher.add_handler(
+        TypeHandler(Update, deduplicator.mark_processed),
+        group=1001
+    )
+    updater.job_queue.run_repeating(
+        flush_processed_updates_job,
+        interval=settings.IDEMPOTENCY_FLUSH_INTERVAL,
+        context=deduplicator,
+    )
+    bot_stats['Deduplicator'] = deduplicator
+
+    updater.job_queue.run_repeating(
+        expire_conversations_job,
+        interval=settings.CONVERSATION_EXPIRE_INTERVAL,
+        context=conv_handler,
+    )
+    bot_stats['Conversations'] = conv_handler
+
+    if settings.THROTTLE_RATE:
+        throttle = ChatThrottle(
+            settings.THROTTLE_RATE,
+            settings.THROTTLE_BURST,
+            settings.THROTTLE_DUPLICATE_WINDOW,
+        )
+        dispatcher.add_handler(
+            TypeHandler(Update, throttle.check_update),
+            group=-20
+        )
+        bot_stats['Throttle'] = throttle
+
+    if settings.CAKE_PREVIEW_WORKERS:
+        _preview_renderer = CakePreviewRenderer(
+            settings.CAKE_PREVIEW_DIR,
+            settings.CAKE_PREVIEW_SIZE,
+            settings.CAKE_PREVIEW_FONT,
+            settings.CAKE_PREVIEW_WORKERS,
+            default_storage,
+            settings.CAKE_PREVIEW_CACHE_SIZE,
+        )
+        bot_stats['Previews'] = _preview_renderer
+
+    if settings.BOT_STATS_INTERVAL:
+        updater.job_queue.run_repeating(
+            log_bot_stats,
+            interval=settings.BOT_STATS_INTERVAL,
+            context=bot_stats,
+        )
+
+    # Матрица совместных выборов собирается до приема апдейтов
+    get_cooccurrence_matrix()
+    if settings.COOCCURRENCE_REBUILD_SECONDS:
+        updater.job_queue.run_repeating(
+            rebuild_cooccurrence_job,
+            interval=settings.COOCCURRENCE_REBUILD_SECONDS,
+            first=settings.COOCCURRENCE_REBUILD_SECONDS,
+        )
+
+    if settings.DRAFTS_SWEEP_INTERVAL:
+        updater.job_queue.run_repeating(
+            sweep_drafts_job,
+            interval=settings.DRAFTS_SWEEP_INTERVAL,
+            first=settings.DRAFTS_SWEEP_INTERVAL,
+        )
+
     updater.start_polling()
     updater.idle()
+    scheduler.stop(settings.BOT_STOP_TIMEOUT)
+    deduplicator.flush()
+    if _preview_renderer:
+        _preview_renderer.shutdown()
 
 
 class Command(BaseCommand):
     help = 'Import module with telegram bot code'
 
     def handle(self, *args, **options):
-        run_bot(settings.TG_TOKEN)
+        configure_logging(
+            settings.LOG_LEVEL,
+            settings.LOG_DEBUG_SAMPLE_RATE,
+        )
+        run_bot(settings.TG_TOKEN, settings.TG_API_URL)
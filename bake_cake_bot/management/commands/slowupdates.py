@@ -0,0 +1,82 @@
+import io
+import json
+import pstats
+
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Summarize profiles of slow updates saved by runbot'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dir',
+            default=settings.SLOW_UPDATE_PROFILE_DIR,
+            help='Directory with saved profiles',
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=10,
+            help='Number of slowest updates and functions to show',
+        )
+
+    def handle(self, *args, **options):
+        profile_dir = Path(options['dir'])
+        records = []
+        for record_path in sorted(profile_dir.glob('*.json')):
+            with open(record_path) as file:
+                record = json.load(file)
+            record['stem'] = record_path.stem
+            records.append(record)
+
+        if not records:
+            self.stdout.write(f'No profiles in {profile_dir}')
+            return
+
+        self.stdout.write(f'Profiles: {len(records)}')
+
+        self.stdout.write('\nBy state before update:')
+        durations_by_state = defaultdict(list)
+        for record in records:
+            durations_by_state[record['state_before']].append(
+                record['duration_ms']
+            )
+        for state, durations in sorted(
+            durations_by_state.items(),
+            key=lambda item: -max(item[1]),
+        ):
+            self.stdout.write(
+                f'  {state}: {len(durations)} updates, '
+                f'avg {sum(durations) / len(durations):.0f} ms, '
+                f'max {max(durations):.0f} ms'
+            )
+
+        self.stdout.write('\nSlowest updates:')
+        slowest = sorted(records, key=lambda record: -record['duration_ms'])
+        for record in slowest[:options['top']]:
+            sql_ms = sum(query['duration_ms'] for query in record['sql'])
+            telegram_ms = sum(
+                call['duration_ms'] for call in record['telegram_calls']
+            )
+            self.stdout.write(
+                f'  {record["stem"]}: {record["duration_ms"]:.0f} ms, '
+                f'{record["state_before"]} -> {record["state_after"]}, '
+                f'{len(record["sql"])} SQL queries ({sql_ms:.0f} ms), '
+                f'{len(record["telegram_calls"])} Bot API calls '
+                f'({telegram_ms:.0f} ms)'
+            )
+
+        self.stdout.write('\nFunctions by cumulative time in all profiles:')
+        profile_paths = [
+            str(profile_dir / f'{record["stem"]}.prof') for record in records
+            if (profile_dir / f'{record["stem"]}.prof').exists()
+        ]
+        stats_output = io.StringIO()
+        stats = pstats.Stats(*profile_paths, stream=stats_output)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(options['top'])
+        self.stdout.write(stats_output.getvalue())
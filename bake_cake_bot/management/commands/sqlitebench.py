@@ -0,0 +1,196 @@
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+from bake_cake_bot.management.commands.runbot import add_option_to_cake
+from bake_cake_bot.management.commands.runbot import confirm_order
+from bake_cake_bot.management.commands.runbot import create_new_cake
+from bake_cake_bot.management.commands.runbot import create_new_order
+from bake_cake_bot.models import Client, Option, Order
+
+
+BENCH_CHAT_ID = 4 * 10 ** 9
+
+
+class BenchResult:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = 0
+        self.locked_errors = 0
+
+    def add(self, operations=0, locked_errors=0):
+        with self.lock:
+            self.operations += operations
+            self.locked_errors += locked_errors
+
+
+def run_until(deadline, result, operation):
+    while time.monotonic() < deadline:
+        try:
+            operation()
+            result.add(operations=1)
+        except OperationalError as error:
+            if 'locked' not in str(error):
+                raise
+            result.add(locked_errors=1)
+    connection.close()
+
+
+def make_bot_operation(chat_id, option_ids):
+    # Покупатель собирает торт из трех параметров и оформляет заказ
+    def create_order():
+        cake_id = create_new_cake(chat_id)
+        for option_id in random.sample(option_ids, 3):
+            add_option_to_cake(option_id, cake_id)
+        order_id = create_new_order([cake_id], chat_id)
+        confirm_order(order_id, chat_id)
+    return create_order
+
+
+def run_admin_operation():
+    # Сотрудник открывает список заказов и меняет статус одного из них.
+    # Трогаем только заказы клиентов бенчмарка, а не настоящих
+    bench_orders = Order.objects.filter(
+        status__gte=1,
+        client__tg_chat_id__gte=BENCH_CHAT_ID,
+    )
+    orders = list(
+        bench_orders
+        .select_related('client')
+        .order_by('-created_at')[:100]
+    )
+    bench_orders.count()
+    if orders:
+        order = random.choice(orders)
+        order.status = min(order.status + 1, 4)
+        order.save()
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark bot writes and admin traffic against the same SQLite '
+        'database. Compare runs with SQLITE_TUNING=1 and SQLITE_TUNING=0 '
+        'on a copy of the database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument(
+            '--bot-threads',
+            type=int,
+            default=4,
+            help='Threads creating orders like the bot scheduler workers',
+        )
+        parser.add_argument(
+            '--admin-processes',
+            type=int,
+            default=2,
+            help='Processes reading and updating orders like gunicorn workers',
+        )
+        parser.add_argument(
+            '--allow-writes',
+            action='store_true',
+            help=(
+                'Required: the benchmark creates clients and orders '
+                'in the configured database, so point it at a copy'
+            ),
+        )
+        parser.add_argument(
+            '--role',
+            choices=['main', 'admin'],
+            default='main',
+            help='Used internally to start admin processes',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The benchmark is meant for SQLite only')
+        if not options['allow_writes']:
+            raise CommandError(
+                'The benchmark writes to '
+                f'{connection.settings_dict["NAME"]}, run it on a copy '
+                'of the database with --allow-writes'
+            )
+
+        if options['role'] == 'admin':
+            result = BenchResult()
+            run_until(
+                time.monotonic() + options['duration'],
+                result,
+                run_admin_operation,
+            )
+            self.stdout.write(json.dumps({
+                'operations': result.operations,
+                'locked_errors': result.locked_errors,
+            }))
+            return
+
+        option_ids = list(Option.objects.values_list('id', flat=True))
+        if len(option_ids) < 3:
+            raise CommandError('Add at least 3 options to the catalog')
+
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+
+        chat_ids = []
+        for number in range(options['bot_threads']):
+            client, _ = Client.objects.get_or_create(
+                tg_chat_id=BENCH_CHAT_ID + number,
+                defaults={'first_name': 'Bench'},
+            )
+            chat_ids.append(client.tg_chat_id)
+        connection.close()
+
+        admin_processes = [
+            subprocess.Popen(
+                [sys.executable, 'manage.py', 'sqlitebench', '--role',
+                 'admin', '--duration', str(options['duration']),
+                 '--allow-writes'],
+                stdout=subprocess.PIPE,
+            )
+            for _ in range(options['admin_processes'])
+        ]
+
+        bot_result = BenchResult()
+        deadline = time.monotonic() + options['duration']
+        bot_threads = [
+            threading.Thread(
+                target=run_until,
+                args=(
+                    deadline,
+                    bot_result,
+                    make_bot_operation(chat_id, option_ids),
+                ),
+            )
+            for chat_id in chat_ids
+        ]
+        for thread in bot_threads:
+            thread.start()
+        for thread in bot_threads:
+            thread.join()
+
+        admin_operations = 0
+        admin_locked_errors = 0
+        for process in admin_processes:
+            output, _ = process.communicate()
+            admin_result = json.loads(output.decode().strip().splitlines()[-1])
+            admin_operations += admin_result['operations']
+            admin_locked_errors += admin_result['locked_errors']
+
+        duration = options['duration']
+        self.stdout.write(f'Journal mode: {journal_mode}')
+        self.stdout.write(
+            f'Bot: {bot_result.operations / duration:.1f} orders/s, '
+            f'"database is locked" errors: {bot_result.locked_errors}'
+        )
+        self.stdout.write(
+            f'Admin: {admin_operations / duration:.1f} operations/s, '
+            f'"database is locked" errors: {admin_locked_errors}'
+        )
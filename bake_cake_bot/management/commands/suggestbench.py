@@ -0,0 +1,123 @@
+import random
+import time
+
+from itertools import product
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bake_cake_bot.management.commands.loadtest import get_percentile
+from bake_cake_bot.suggestions import BudgetSuggester
+
+
+def make_catalog(categories_count, options_count, mandatory_count):
+    # Синтетический каталог: цены кратны 50 руб., популярность случайная
+    option_ids = iter(range(1, categories_count * options_count + 1))
+    catalog = []
+    for category_index in range(categories_count):
+        options = [
+            (
+                next(option_ids),
+                random.randint(1, 40) * 50,
+                random.randint(0, 1000),
+            )
+            for _ in range(options_count)
+        ]
+        catalog.append((category_index < mandatory_count, options))
+    return catalog
+
+
+def suggest_brute_force(catalog, budget, limit):
+    category_choices = []
+    for is_mandatory, options in catalog:
+        choices = [(price, score) for option_id, price, score in options]
+        if not is_mandatory:
+            choices.append((0, 0))
+        category_choices.append(choices)
+
+    scores = []
+    for combination in product(*category_choices):
+        if sum(price for price, score in combination) <= budget:
+            scores.append(sum(score for price, score in combination))
+    return sorted(scores, reverse=True)[:limit]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark budget cake suggestions on a synthetic catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=6)
+        parser.add_argument(
+            '--options',
+            type=int,
+            default=40,
+            help='Options in every category',
+        )
+        parser.add_argument(
+            '--mandatory',
+            type=int,
+            default=2,
+            help='Number of mandatory categories',
+        )
+        parser.add_argument('--limit', type=int, default=5)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Compare scores with a full enumeration, small catalogs only',
+        )
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        catalog = make_catalog(
+            options['categories'],
+            options['options'],
+            options['mandatory'],
+        )
+        combinations = 1
+        for is_mandatory, category_options in catalog:
+            combinations *= len(category_options) + (not is_mandatory)
+        if options['verify'] and combinations > 10 ** 6:
+            raise CommandError(
+                f'{combinations} combinations are too many to verify'
+            )
+
+        started_at = time.perf_counter()
+        suggester = BudgetSuggester(catalog)
+        build_ms = (time.perf_counter() - started_at) * 1000
+
+        max_price = sum(
+            max(price for option_id, price, score in category_options)
+            for is_mandatory, category_options in catalog
+        )
+        latencies = []
+        mismatches = 0
+        for _ in range(options['queries']):
+            budget = random.randint(suggester.min_price, max_price)
+            started_at = time.perf_counter()
+            suggestions = suggester.suggest(budget, options['limit'])
+            latencies.append((time.perf_counter() - started_at) * 1000)
+
+            if options['verify']:
+                expected = suggest_brute_force(
+                    catalog,
+                    budget,
+                    options['limit']
+                )
+                if [score for price, score, _ in suggestions] != expected:
+                    mismatches += 1
+
+        self.stdout.write(
+            f'Catalog: {options["categories"]} categories, '
+            f'{options["options"]} options each, '
+            f'{combinations} combinations'
+        )
+        self.stdout.write(f'Build: {build_ms:.2f} ms')
+        self.stdout.write(
+            f'Query: mean {sum(latencies) / len(latencies):.2f} ms, '
+            f'p50 {get_percentile(latencies, 50):.2f} ms, '
+            f'p99 {get_percentile(latencies, 99):.2f} ms, '
+            f'max {max(latencies):.2f} ms'
+        )
+        if options['verify']:
+            self.stdout.write(f'Mismatches with full enumeration: {mismatches}')
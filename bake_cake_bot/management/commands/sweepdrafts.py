@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bake_cake_bot.sweeper import sweep_drafts
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned draft cakes and unconfirmed orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age-hours',
+            type=int,
+            default=settings.DRAFTS_MAX_AGE_HOURS,
+            help='Delete drafts older than this number of hours',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of rows deleted in one transaction',
+        )
+
+    def handle(self, *args, **options):
+        orders_count, cakes_count = sweep_drafts(
+            options['max_age_hours'],
+            options['batch_size'],
+        )
+        self.stdout.write(
+            f'Deleted {orders_count} draft orders and {cakes_count} draft cakes'
+        )
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.8 on 2026-10-19 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_option_prices(apps, schema_editor):
+    CakeOption = apps.get_model('bake_cake_bot', 'CakeOption')
+    Option = apps.get_model('bake_cake_bot', 'Option')
+    CakeOption.objects.update(
+        price=models.Subquery(
+            Option.objects
+            .filter(id=models.OuterRef('option_id'))
+            .values('price')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bake_cake_bot', '0011_alter_order_client'),
+    ]
+
+    operations = [
+        # Таблица связи Cake.options уже существует, поэтому модель
+        # только регистрируется в состоянии миграций
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='CakeOption',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('cake', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cake_options', to='bake_cake_bot.cake', verbose_name='Торт')),
+                        ('option', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cake_options', to='bake_cake_bot.option', verbose_name='Параметр торта')),
+                    ],
+                    options={
+                        'db_table': 'bake_cake_bot_cake_options',
+                        'unique_together': {('cake', 'option')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='cake',
+                    name='options',
+                    field=models.ManyToManyField(db_index=True, related_name='used_in_cake', through='bake_cake_bot.CakeOption', to='bake_cake_bot.Option', verbose_name='Параметры торта'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cakeoption',
+            name='price',
+            field=models.IntegerField(blank=True, null=True, help_text='Если не указана, берется текущая цена параметра', verbose_name='Цена на момент выбора'),
+        ),
+        migrations.RunPython(fill_option_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cakeoption',
+            name='price',
+            field=models.IntegerField(blank=True, help_text='Если не указана, берется текущая цена параметра', verbose_name='Цена на момент выбора'),
+        ),
+    ]
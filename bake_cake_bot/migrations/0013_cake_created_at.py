@@ -0,0 +1,28 @@
+# Generated by Django 3.2.8 on 2026-10-19 18:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bake_cake_bot', '0012_cakeoption'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cake',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата создания торта'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='cake',
+            index=models.Index(fields=['is_in_order', 'created_at'], name='cake_draft_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ),
+    ]
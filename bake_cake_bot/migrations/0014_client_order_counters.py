@@ -0,0 +1,63 @@
+# Generated by Django 3.2.8 on 2026-10-19 18:29
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_client_counters(apps, schema_editor):
+    Client = apps.get_model('bake_cake_bot', 'Client')
+    Order = apps.get_model('bake_cake_bot', 'Order')
+    confirmed_orders = (
+        Order.objects
+        .filter(client=models.OuterRef('id'), status__gte=1)
+        .order_by()
+        .values('client')
+    )
+    Client.objects.update(
+        orders_count=Coalesce(
+            models.Subquery(
+                confirmed_orders.annotate(count=models.Count('id'))
+                .values('count'),
+                output_field=models.IntegerField(),
+            ),
+            0,
+        ),
+        lifetime_amount=Coalesce(
+            models.Subquery(
+                confirmed_orders.annotate(total=models.Sum('total_amount'))
+                .values('total'),
+                output_field=models.IntegerField(),
+            ),
+            0,
+        ),
+        last_order_at=models.Subquery(
+            confirmed_orders.annotate(last=models.Max('created_at'))
+            .values('last'),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bake_cake_bot', '0013_cake_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='last_order_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Дата последнего заказа'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='lifetime_amount',
+            field=models.IntegerField(db_index=True, default=0, editable=False, verbose_name='Сумма всех заказов'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='orders_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Количество заказов'),
+        ),
+        migrations.RunPython(fill_client_counters, migrations.RunPython.noop),
+    ]
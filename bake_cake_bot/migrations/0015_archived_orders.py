@@ -0,0 +1,50 @@
+# Generated by Django 3.2.8 on 2026-10-19 18:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bake_cake_bot', '0014_client_order_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedCake',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='Номер торта')),
+                ('text', models.CharField(blank=True, default='', max_length=100, verbose_name='Надпись на торте')),
+                ('price', models.IntegerField(verbose_name='Цена торта')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания торта')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='Номер заказа')),
+                ('total_amount', models.IntegerField(verbose_name='Сумма заказа')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания заказа')),
+                ('modified_at', models.DateTimeField(verbose_name='Дата изменения заказа')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата переноса в архив')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to='bake_cake_bot.client', verbose_name='Клиент')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedCakeOption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category_title', models.CharField(max_length=100, verbose_name='Категория')),
+                ('option_name', models.CharField(max_length=100, verbose_name='Параметр торта')),
+                ('category_choice_order', models.IntegerField(default=0, verbose_name='Порядок выбора категории')),
+                ('price', models.IntegerField(verbose_name='Цена на момент выбора')),
+                ('cake', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cake_options', to='bake_cake_bot.archivedcake', verbose_name='Торт')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='archivedcake',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cakes', to='bake_cake_bot.archivedorder', verbose_name='Заказ'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.8 on 2026-10-19 18:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bake_cake_bot', '0015_archived_orders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliverySlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('starts_at', models.DateTimeField(unique=True, verbose_name='Начало доставки')),
+                ('ends_at', models.DateTimeField(verbose_name='Конец доставки')),
+                ('capacity', models.PositiveIntegerField(default=1, verbose_name='Вместимость')),
+                ('reserved', models.PositiveIntegerField(default=0, editable=False, verbose_name='Забронировано')),
+            ],
+            options={
+                'ordering': ['starts_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='deliveryslot',
+            constraint=models.CheckConstraint(check=models.Q(('reserved__lte', django.db.models.expressions.F('capacity'))), name='delivery_slot_not_overbooked'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_slot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='bake_cake_bot.deliveryslot', verbose_name='Время доставки'),
+        ),
+    ]
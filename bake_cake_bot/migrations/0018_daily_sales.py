@@ -0,0 +1,42 @@
+# Generated by Django 3.2.8 on 2026-10-19 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bake_cake_bot', '0017_order_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True, verbose_name='День')),
+                ('orders_count', models.IntegerField(default=0, verbose_name='Заказов')),
+                ('revenue', models.IntegerField(default=0, verbose_name='Выручка')),
+                ('cakes_count', models.IntegerField(default=0, verbose_name='Тортов')),
+                ('cakes_amount', models.IntegerField(default=0, verbose_name='Стоимость тортов')),
+            ],
+            options={
+                'verbose_name': 'продажи за день',
+                'verbose_name_plural': 'продажи по дням',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyOptionSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('category_title', models.CharField(max_length=100, verbose_name='Категория')),
+                ('option_name', models.CharField(max_length=100, verbose_name='Параметр торта')),
+                ('cakes_count', models.IntegerField(default=0, verbose_name='Тортов')),
+            ],
+            options={
+                'unique_together': {('day', 'category_title', 'option_name')},
+            },
+        ),
+    ]
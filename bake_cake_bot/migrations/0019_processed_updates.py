@@ -0,0 +1,29 @@
+# Generated by Django 3.2.8 on 2026-10-19 19:01
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bake_cake_bot', '0018_daily_sales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedAction',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Ключ')),
+                ('result', models.BigIntegerField(null=True, verbose_name='Результат')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Выполнено')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProcessedUpdate',
+            fields=[
+                ('update_id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID апдейта')),
+                ('processed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Обработан')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.8 on 2026-10-19 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bake_cake_bot', '0019_processed_updates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Название')),
+                ('text', models.TextField(verbose_name='Текст')),
+                ('last_chat_id', models.BigIntegerField(default=0, verbose_name='Последний ID чата')),
+                ('sent_count', models.IntegerField(default=0, verbose_name='Отправлено')),
+                ('failed_count', models.IntegerField(default=0, verbose_name='Не доставлено')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+            ],
+            options={
+                'verbose_name': 'рассылка',
+                'verbose_name_plural': 'рассылки',
+            },
+        ),
+    ]
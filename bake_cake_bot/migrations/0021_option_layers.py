@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-19 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bake_cake_bot', '0020_broadcasts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='option',
+            name='layer',
+            field=models.ImageField(blank=True, help_text='PNG с прозрачным фоном, слои накладываются в порядке выбора категорий', upload_to='cake_layers', verbose_name='Слой картинки торта'),
+        ),
+    ]
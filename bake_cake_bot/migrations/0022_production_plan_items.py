@@ -0,0 +1,38 @@
+# Generated by Django 3.2.8 on 2026-10-19 19:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_production_plan(apps, schema_editor):
+    # План раньше жил только в кеше, здесь он считается по заказам в работе
+    CakeOption = apps.get_model('bake_cake_bot', 'CakeOption')
+    ProductionPlanItem = apps.get_model('bake_cake_bot', 'ProductionPlanItem')
+    counts = (
+        CakeOption.objects
+        .filter(cake__in_orders__status__in=(1, 2))
+        .values_list('option_id')
+        .annotate(cakes_count=models.Count('id'))
+    )
+    ProductionPlanItem.objects.bulk_create([
+        ProductionPlanItem(option_id=option_id, cakes_count=cakes_count)
+        for option_id, cakes_count in counts
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bake_cake_bot', '0021_option_layers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductionPlanItem',
+            fields=[
+                ('option', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='production_plan_item', serialize=False, to='bake_cake_bot.option', verbose_name='Параметр торта')),
+                ('cakes_count', models.IntegerField(default=0, verbose_name='Тортов')),
+            ],
+        ),
+        migrations.RunPython(fill_production_plan, migrations.RunPython.noop),
+    ]
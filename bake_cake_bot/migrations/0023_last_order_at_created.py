@@ -0,0 +1,42 @@
+# Generated by Django 3.2.8 on 2026-10-19 20:12
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Greatest
+
+
+def fill_last_order_at(apps, schema_editor):
+    # Раньше дата последнего заказа бралась из даты изменения заказа,
+    # теперь это дата создания последнего подтвержденного заказа
+    Client = apps.get_model('bake_cake_bot', 'Client')
+    Order = apps.get_model('bake_cake_bot', 'Order')
+    ArchivedOrder = apps.get_model('bake_cake_bot', 'ArchivedOrder')
+
+    def get_last_created_at(orders):
+        return models.Subquery(
+            orders
+            .filter(client=models.OuterRef('id'))
+            .order_by()
+            .values('client')
+            .annotate(last=models.Max('created_at'))
+            .values('last')
+        )
+
+    last_order_at = get_last_created_at(Order.objects.filter(status__gte=1))
+    last_archived_at = get_last_created_at(ArchivedOrder.objects.all())
+    Client.objects.update(
+        last_order_at=Greatest(
+            Coalesce(last_order_at, last_archived_at),
+            Coalesce(last_archived_at, last_order_at),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bake_cake_bot', '0022_production_plan_items'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_last_order_at, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,32 @@
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models import Case, F, Max, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+
+def get_last_order_at(client):
+    # Дата последнего заказа клиента - дата создания самого нового
+    # из его подтвержденных заказов, включая архив. client - id
+    # клиента или OuterRef на него
+    def get_last_created_at(orders):
+        return Subquery(
+            orders
+            .filter(client=client)
+            .order_by()
+            .values('client')
+            .annotate(last=Max('created_at'))
+            .values('last')
+        )
+
+    # В архив попадают только завершенные заказы, поэтому давний заказ,
+    # застрявший в работе, бывает старше архивных. Greatest с NULL дает
+    # NULL, и каждая сторона подменяется другой, если своих заказов нет
+    last_order_at = get_last_created_at(Order.objects.filter(status__gte=1))
+    last_archived_at = get_last_created_at(ArchivedOrder.objects.all())
+    return Greatest(
+        Coalesce(last_order_at, last_archived_at),
+        Coalesce(last_archived_at, last_order_at),
+    )
 
 
 class Client(models.Model):
@@ -31,6 +58,26 @@ class Client(models.Model):
         blank=True
     )
 
+    # Счетчики по подтвержденным заказам, обновляются при смене статуса
+    # заказа. Пересчитать заново: python manage.py rebuildclientstats
+    orders_count = models.IntegerField(
+        'Количество заказов',
+        default=0,
+        editable=False
+    )
+    lifetime_amount = models.IntegerField(
+        'Сумма всех заказов',
+        default=0,
+        db_index=True,
+        editable=False
+    )
+    last_order_at = models.DateTimeField(
+        'Дата последнего заказа',
+        null=True,
+        blank=True,
+        editable=False
+    )
+
     def __str__(self):
         return f'{self.first_name} {self.last_name} ({self.tg_chat_id})'
 
@@ -58,6 +105,13 @@ class Option(models.Model):
         db_index=True,
         related_name='options'
     )
+    layer = models.ImageField(
+        'Слой картинки торта',
+        upload_to='cake_layers',
+        help_text='PNG с прозрачным фоном, слои накладываются '
+                  'в порядке выбора категорий',
+        blank=True
+    )
 
     def __str__(self):
         return f'{self.category} {self.name}'
@@ -72,6 +126,7 @@ class Cake(models.Model):
     )
     options = models.ManyToManyField(
         'Option',
+        through='CakeOption',
         verbose_name='Параметры торта',
         related_name='used_in_cake',
         db_index=True,
@@ -89,19 +144,93 @@ class Cake(models.Model):
         default=False
     )
     price = models.IntegerField('Цена торта', default=0)
+    created_at = models.DateTimeField(
+        'Дата создания торта',
+        auto_now_add=True
+    )
 
-    def save(self, *args, **kwargs):
-        if self.id and self.options.all():
-            self.price = (
-                self.options
-                .aggregate(total_price=Sum('price'))['total_price']
-            )
-        super(Cake, self).save(*args, **kwargs)
+    class Meta:
+        indexes = [
+            # Для поиска брошенных черновиков тортов
+            models.Index(
+                fields=['is_in_order', 'created_at'],
+                name='cake_draft_created_idx'
+            ),
+        ]
+
+    def recalculate_price(self):
+        # Пересчет по зафиксированным ценам параметров, а не по каталогу.
+        # Нужен только при ручной правке состава торта в админке
+        self.price = (
+            self.cake_options
+            .aggregate(total_price=Sum('price'))['total_price']
+        ) or 0
+        return self.price
 
     def __str__(self):
         return f'Торт для {self.created_by}, цена {self.price}'
 
 
+class CakeOption(models.Model):
+    cake = models.ForeignKey(
+        'Cake',
+        verbose_name='Торт',
+        related_name='cake_options',
+        on_delete=models.CASCADE
+    )
+    option = models.ForeignKey(
+        'Option',
+        verbose_name='Параметр торта',
+        related_name='cake_options',
+        on_delete=models.CASCADE
+    )
+    price = models.IntegerField(
+        'Цена на момент выбора',
+        help_text='Если не указана, берется текущая цена параметра',
+        blank=True
+    )
+
+    class Meta:
+        # Таблица досталась от автоматически созданной связи Cake.options
+        db_table = 'bake_cake_bot_cake_options'
+        unique_together = [['cake', 'option']]
+
+    def save(self, *args, **kwargs):
+        if self.price is None:
+            self.price = self.option.price
+        super(CakeOption, self).save(*args, **kwargs)
+
+    def __str__(self):
+        return f'{self.option} за {self.price}'
+
+
+class DeliverySlot(models.Model):
+    starts_at = models.DateTimeField('Начало доставки', unique=True)
+    ends_at = models.DateTimeField('Конец доставки')
+    capacity = models.PositiveIntegerField('Вместимость', default=1)
+    reserved = models.PositiveIntegerField(
+        'Забронировано',
+        default=0,
+        editable=False
+    )
+
+    class Meta:
+        ordering = ['starts_at']
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(reserved__lte=F('capacity')),
+                name='delivery_slot_not_overbooked'
+            ),
+        ]
+
+    def __str__(self):
+        starts_at = timezone.localtime(self.starts_at)
+        ends_at = timezone.localtime(self.ends_at)
+        return (
+            f'{starts_at:%d.%m} {starts_at:%H:%M}–{ends_at:%H:%M}'
+        )
+
+
 class Order(models.Model):
     ORDER_STATES = [
         (0, 'Заявка формируется'),
@@ -124,6 +253,15 @@ class Order(models.Model):
     )
 
     total_amount = models.IntegerField('Сумма заказа', default=0) 
+
+    delivery_slot = models.ForeignKey(
+        'DeliverySlot',
+        verbose_name='Время доставки',
+        related_name='orders',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
     
     cakes = models.ManyToManyField(
         'Cake',
@@ -139,18 +277,238 @@ class Order(models.Model):
         auto_now=True
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['status', 'created_at'],
+                name='order_status_created_idx'
+            ),
+            # Для date_hierarchy в админке
+            models.Index(fields=['created_at'], name='order_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        order = super().from_db(db, field_names, values)
+        order._remember_counted_values()
+        return order
+
+    def _remember_counted_values(self):
+        self._loaded_status = self.__dict__.get('status')
+        self._loaded_total_amount = self.__dict__.get('total_amount')
+
+    def is_confirmed(self):
+        return self.status >= 1
+
     def save(self, *args, **kwargs):
+        was_confirmed = (getattr(self, '_loaded_status', None) or 0) >= 1
+        loaded_total_amount = getattr(self, '_loaded_total_amount', None) or 0
+
+        with transaction.atomic():
+            super(Order, self).save(*args, **kwargs)
+
+            client_orders = Client.objects.filter(id=self.client_id)
+            if not was_confirmed and self.is_confirmed():
+                client_orders.update(
+                    orders_count=F('orders_count') + 1,
+                    lifetime_amount=F('lifetime_amount') + self.total_amount,
+                    # Подтвердить можно и давно созданный заказ
+                    last_order_at=Case(
+                        When(
+                            last_order_at__gte=self.created_at,
+                            then=F('last_order_at')
+                        ),
+                        default=Value(self.created_at),
+                    ),
+                )
+            elif was_confirmed and not self.is_confirmed():
+                client_orders.update(
+                    orders_count=F('orders_count') - 1,
+                    lifetime_amount=F('lifetime_amount') - loaded_total_amount,
+                    last_order_at=get_last_order_at(self.client_id),
+                )
+            elif was_confirmed and self.total_amount != loaded_total_amount:
+                client_orders.update(
+                    lifetime_amount=(
+                        F('lifetime_amount')
+                        + self.total_amount
+                        - loaded_total_amount
+                    ),
+                )
+        self._remember_counted_values()
+
+    def recalculate_total_amount(self):
         # Стоимость заказа пересчитывается только в случае,
         # если заказ еще не перешел к сборке
-        if self.id and self.status < 2:
+        if self.status < 2:
             self.total_amount = (
                 self.cakes
                 .aggregate(total_price=Sum('price'))['total_price']
-            )
-        super(Order, self).save(*args, **kwargs)
+            ) or 0
+        return self.total_amount
 
     def get_order_states(self):
         return self.ORDER_STATES
 
     def __str__(self):
         return f'Заказ {self.id} на сумму {self.total_amount}'
+
+
+class ProductionPlanItem(models.Model):
+    # Сколько тортов с параметром нужно для заказов в работе.
+    # Пересчитать заново: python manage.py productionplan --rebuild
+    option = models.OneToOneField(
+        'Option',
+        verbose_name='Параметр торта',
+        related_name='production_plan_item',
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    cakes_count = models.IntegerField('Тортов', default=0)
+
+    def __str__(self):
+        return f'{self.option}: {self.cakes_count}'
+
+
+class ArchivedOrder(models.Model):
+    # Завершенные заказы переносятся сюда командой archiveorders
+    id = models.BigIntegerField('Номер заказа', primary_key=True)
+    client = models.ForeignKey(
+        'Client',
+        verbose_name='Клиент',
+        related_name='archived_orders',
+        on_delete=models.CASCADE,
+    )
+    total_amount = models.IntegerField('Сумма заказа')
+    created_at = models.DateTimeField('Дата создания заказа')
+    modified_at = models.DateTimeField('Дата изменения заказа')
+    archived_at = models.DateTimeField(
+        'Дата переноса в архив',
+        auto_now_add=True
+    )
+
+    def __str__(self):
+        return f'Архивный заказ {self.id} на сумму {self.total_amount}'
+
+
+class ArchivedCake(models.Model):
+    id = models.BigIntegerField('Номер торта', primary_key=True)
+    order = models.ForeignKey(
+        'ArchivedOrder',
+        verbose_name='Заказ',
+        related_name='cakes',
+        on_delete=models.CASCADE,
+    )
+    text = models.CharField(
+        'Надпись на торте',
+        max_length=100,
+        blank=True,
+        default=''
+    )
+    price = models.IntegerField('Цена торта')
+    created_at = models.DateTimeField('Дата создания торта')
+
+    def __str__(self):
+        return f'Архивный торт {self.id}, цена {self.price}'
+
+
+class ArchivedCakeOption(models.Model):
+    cake = models.ForeignKey(
+        'ArchivedCake',
+        verbose_name='Торт',
+        related_name='cake_options',
+        on_delete=models.CASCADE,
+    )
+    # Названия сохраняются, чтобы архив не зависел от изменений каталога
+    category_title = models.CharField('Категория', max_length=100)
+    option_name = models.CharField('Параметр торта', max_length=100)
+    category_choice_order = models.IntegerField(
+        'Порядок выбора категории',
+        default=0
+    )
+    price = models.IntegerField('Цена на момент выбора')
+
+    def __str__(self):
+        return f'{self.category_title} {self.option_name} за {self.price}'
+
+
+class DailySales(models.Model):
+    # Сводка по подтвержденным заказам за день создания заказа
+    day = models.DateField('День', unique=True)
+    orders_count = models.IntegerField('Заказов', default=0)
+    revenue = models.IntegerField('Выручка', default=0)
+    cakes_count = models.IntegerField('Тортов', default=0)
+    cakes_amount = models.IntegerField('Стоимость тортов', default=0)
+
+    class Meta:
+        ordering = ['-day']
+        verbose_name = 'продажи за день'
+        verbose_name_plural = 'продажи по дням'
+
+    def get_average_cake_price(self):
+        if not self.cakes_count:
+            return 0
+        return round(self.cakes_amount / self.cakes_count)
+
+    def __str__(self):
+        return f'Продажи за {self.day}'
+
+
+class DailyOptionSales(models.Model):
+    # Названия, а не ссылки на каталог: так в сводку попадает и архив
+    day = models.DateField('День')
+    category_title = models.CharField('Категория', max_length=100)
+    option_name = models.CharField('Параметр торта', max_length=100)
+    cakes_count = models.IntegerField('Тортов', default=0)
+
+    class Meta:
+        unique_together = [['day', 'category_title', 'option_name']]
+
+    def __str__(self):
+        return f'{self.category_title} {self.option_name} за {self.day}'
+
+
+class ProcessedUpdate(models.Model):
+    # Апдейты Телеграма, обработка которых завершена
+    update_id = models.BigIntegerField('ID апдейта', primary_key=True)
+    processed_at = models.DateTimeField(
+        'Обработан',
+        default=timezone.now,
+        db_index=True
+    )
+
+    def __str__(self):
+        return f'Апдейт {self.update_id}'
+
+
+class ProcessedAction(models.Model):
+    # Однократные действия: ключ из чата, действия и объекта
+    key = models.CharField('Ключ', max_length=100, primary_key=True)
+    result = models.BigIntegerField('Результат', null=True)
+    created_at = models.DateTimeField(
+        'Выполнено',
+        default=timezone.now,
+        db_index=True
+    )
+
+    def __str__(self):
+        return self.key
+
+
+class Broadcast(models.Model):
+    # Рассылка клиентам по возрастанию ID чата. last_chat_id - контрольная
+    # точка: всем клиентам до нее включительно сообщение уже отправлено
+    name = models.CharField('Название', max_length=100, unique=True)
+    text = models.TextField('Текст')
+    last_chat_id = models.BigIntegerField('Последний ID чата', default=0)
+    sent_count = models.IntegerField('Отправлено', default=0)
+    failed_count = models.IntegerField('Не доставлено', default=0)
+    created_at = models.DateTimeField('Создана', auto_now_add=True)
+    finished_at = models.DateTimeField('Завершена', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'рассылка'
+        verbose_name_plural = 'рассылки'
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import shutil
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+INSCRIPTION_COLOR = (90, 45, 20, 255)
+
+
+def load_font(font_path, size):
+    try:
+        return ImageFont.truetype(font_path, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def render_preview(layer_paths, text, size, font_path, output_path):
+    # Выполняется в отдельном процессе, поэтому не трогает Django:
+    # слои накладываются по порядку категорий, надпись - поверх всех
+    image = Image.new('RGBA', (size, size), (255, 255, 255, 255))
+    for layer_path in layer_paths:
+        with Image.open(layer_path) as layer:
+            image.alpha_composite(layer.convert('RGBA').resize((size, size)))
+    if text:
+        draw = ImageDraw.Draw(image)
+        font = load_font(font_path, size // 14)
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+        draw.text(
+            ((size - right + left) // 2, size * 9 // 10 - bottom),
+            text,
+            font=font,
+            fill=INSCRIPTION_COLOR,
+        )
+
+    # Во временный файл и переименованием, чтобы никто не прочитал
+    # недописанную картинку
+    temp_path = f'{output_path}.{os.getpid()}.tmp'
+    image.convert('RGB').save(temp_path, 'PNG')
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+class CakePreviewRenderer:
+    # Превью кешируется дважды: картинка лежит на диске, а file_id
+    # загруженной в Телеграм картинки позволяет отправить ее повторно
+    # без рендера и без загрузки. Ключ - размер, шрифт, слои по порядку
+    # и надпись. Слои читаются из файлового хранилища Django, общего
+    # с админкой, и копируются в папку кеша: процессы рендера работают
+    # только с локальными файлами. Превью и слоев в кеше не больше
+    # max_entries, давно не нужные удаляются вместе с file_id
+    def __init__(self, cache_dir, size, font_path, workers, storage,
+                 max_entries=10000):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.storage = storage
+        self.size = size
+        self.font_path = font_path
+        self.max_entries = max_entries
+        # spawn, а не fork: в боте уже работают потоки
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context('spawn'),
+        )
+        self._file_ids = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Имена записей кеша от давно использованных к недавним: ключ
+        # превью или имя файла слоя
+        self._entries = OrderedDict()
+
+        self.rendered_count = 0
+        self.disk_hits_count = 0
+        self.file_id_hits_count = 0
+        self.evicted_count = 0
+
+        # Кеш с прошлых запусков упорядочиваем по времени изменения файлов
+        cached_paths = sorted(
+            self.cache_dir.iterdir(),
+            key=lambda path: path.stat().st_mtime
+        )
+        for path in cached_paths:
+            if path.suffix == '.tmp':
+                continue
+            name = path.name if path.name.startswith('layer-') else path.stem
+            self._entries[name] = None
+            self._entries.move_to_end(name)
+        with self._lock:
+            self._evict()
+
+    def _use_entry(self, name):
+        with self._lock:
+            self._entries[name] = None
+            self._entries.move_to_end(name)
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            # Превью, которое еще рендерится, удалять рано
+            name = next(
+                (name for name in self._entries if name not in self._pending),
+                None
+            )
+            if name is None:
+                return
+            del self._entries[name]
+            self.evicted_count += 1
+            if name.startswith('layer-'):
+                (self.cache_dir / name).unlink(missing_ok=True)
+                continue
+            self._file_ids.pop(name, None)
+            (self.cache_dir / f'{name}.png').unlink(missing_ok=True)
+            (self.cache_dir / f'{name}.file_id').unlink(missing_ok=True)
+
+    def get_key(self, layer_names, text):
+        # Имя файла слоя меняется при новой загрузке, старые превью
+        # с этим слоем просто перестают совпадать
+        return hashlib.sha1(
+            '\n'.join(
+                [str(self.size), self.font_path, *layer_names, text]
+            ).encode()
+        ).hexdigest()
+
+    def get_layer_path(self, layer_name):
+        # По той же причине скопированный слой не обновляется
+        layer_path = self.cache_dir / (
+            'layer-'
+            + hashlib.sha1(layer_name.encode()).hexdigest()
+            + Path(layer_name).suffix
+        )
+        self._use_entry(layer_path.name)
+        if not layer_path.exists():
+            temp_path = f'{layer_path}.{threading.get_ident()}.tmp'
+            with self.storage.open(layer_name, 'rb') as layer:
+                with open(temp_path, 'wb') as layer_copy:
+                    shutil.copyfileobj(layer, layer_copy)
+            os.replace(temp_path, layer_path)
+        return str(layer_path)
+
+    def get_file_id(self, key):
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            file_id_path = self.cache_dir / f'{key}.file_id'
+            if file_id_path.exists():
+                file_id = file_id_path.read_text().strip()
+                self._remember_in_memory(key, file_id)
+        return file_id
+
+    def remember_file_id(self, key, file_id):
+        (self.cache_dir / f'{key}.file_id').write_text(file_id)
+        self._remember_in_memory(key, file_id)
+
+    def _remember_in_memory(self, key, file_id):
+        # Уже вытесненное превью в памяти не запоминается
+        with self._lock:
+            if key in self._entries:
+                self._file_ids[key] = file_id
+
+    def render(self, key, layer_names, text):
+        image_path = self.cache_dir / f'{key}.png'
+        if image_path.exists():
+            self.disk_hits_count += 1
+            return image_path
+        layer_paths = [
+            self.get_layer_path(layer_name) for layer_name in layer_names
+        ]
+
+        # Одинаковые превью, запрошенные одновременно, рендерятся один раз
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pool.submit(
+                    render_preview,
+                    layer_paths,
+                    text,
+                    self.size,
+                    self.font_path,
+                    str(image_path),
+                )
+                self._pending[key] = future
+                self.rendered_count += 1
+        try:
+            future.result()
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+        return image_path
+
+    def send(self, bot, chat_id, layer_names, text=''):
+        key = self.get_key(layer_names, text)
+        self._use_entry(key)
+        file_id = self.get_file_id(key)
+        if file_id:
+            self.file_id_hits_count += 1
+            bot.send_photo(chat_id, photo=file_id)
+            return
+
+        image_path = self.render(key, layer_names, text)
+        with open(image_path, 'rb') as image:
+            message = bot.send_photo(chat_id, photo=image)
+        # Самый большой из размеров, которые сделал Телеграм
+        self.remember_file_id(key, message.photo[-1].file_id)
+
+    def get_stats(self):
+        return {
+            'rendered': self.rendered_count,
+            'disk_hits': self.disk_hits_count,
+            'file_id_hits': self.file_id_hits_count,
+            'cached': len(self._entries),
+            'evicted': self.evicted_count,
+            'pending': len(self._pending),
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
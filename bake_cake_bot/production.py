@@ -0,0 +1,132 @@
+import logging
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from bake_cake_bot.models import CakeOption, ProductionPlanItem
+
+
+logger = logging.getLogger(__name__)
+
+# Заказы в этих статусах уже подтверждены, но торты еще не испечены
+ACTIVE_STATUSES = (1, 2)
+
+
+def count_active_options():
+    # Один сгруппированный запрос по Cake.options через таблицу связи
+    return dict(
+        CakeOption.objects
+        .filter(cake__in_orders__status__in=ACTIVE_STATUSES)
+        .values_list('option_id')
+        .annotate(cakes_count=Count('id'))
+    )
+
+
+def count_order_options(order_id):
+    return dict(
+        CakeOption.objects
+        .filter(cake__in_orders__id=order_id)
+        .values_list('option_id')
+        .annotate(cakes_count=Count('id'))
+    )
+
+
+def get_order_plan_counts(order_id, status):
+    # Вклад заказа в план: параметры его тортов, если заказ в работе
+    if not order_id or not is_active(status):
+        return {}
+    return count_order_options(order_id)
+
+
+def rebuild_production_plan():
+    counts = count_active_options()
+    with transaction.atomic():
+        ProductionPlanItem.objects.all().delete()
+        ProductionPlanItem.objects.bulk_create([
+            ProductionPlanItem(option_id=option_id, cakes_count=cakes_count)
+            for option_id, cakes_count in counts.items()
+        ])
+    logger.info('Rebuilt production plan for %s options', len(counts))
+    return counts
+
+
+def get_production_plan():
+    return list(
+        ProductionPlanItem.objects
+        .filter(cakes_count__gt=0)
+        .order_by(
+            'option__category__choice_order',
+            'option__category_id',
+            'option_id',
+        )
+        .values_list('option__category__title', 'option__name', 'cakes_count')
+    )
+
+
+def apply_plan_delta(option_counts, sign):
+    # Счетчики меняются через F() в транзакции сохранения заказа,
+    # поэтому их видят все процессы и откат заказа откатывает и план
+    if not option_counts:
+        return
+    ProductionPlanItem.objects.bulk_create(
+        [
+            ProductionPlanItem(option_id=option_id)
+            for option_id in option_counts
+        ],
+        ignore_conflicts=True
+    )
+    for option_id, cakes_count in option_counts.items():
+        ProductionPlanItem.objects.filter(option_id=option_id).update(
+            cakes_count=F('cakes_count') + sign * cakes_count
+        )
+
+
+def replace_order_plan(counts_before, counts_after):
+    apply_plan_delta(
+        {
+            option_id: (
+                counts_after.get(option_id, 0)
+                - counts_before.get(option_id, 0)
+            )
+            for option_id in counts_before.keys() | counts_after.keys()
+            if counts_after.get(option_id) != counts_before.get(option_id)
+        },
+        1
+    )
+
+
+def is_active(status):
+    return status in ACTIVE_STATUSES
+
+
+def track_order_status(sender, instance, **kwargs):
+    # Заказ из формы админки учитывается в OrderAdmin.save_related,
+    # когда его торты уже сохранены
+    if getattr(instance, '_track_related_later', False):
+        return
+    was_active = is_active(getattr(instance, '_loaded_status', None))
+    if was_active == is_active(instance.status):
+        return
+
+    option_counts = count_order_options(instance.id)
+    sign = 1 if is_active(instance.status) else -1
+    apply_plan_delta(option_counts, sign)
+
+
+def track_order_delete(sender, instance, **kwargs):
+    if not is_active(getattr(instance, '_loaded_status', instance.status)):
+        return
+    apply_plan_delta(count_order_options(instance.id), -1)
+
+
+def format_production_plan(plan):
+    lines = []
+    current_category = None
+    for category_title, option_name, cakes_count in plan:
+        if category_title != current_category:
+            if lines:
+                lines.append('')
+            lines.append(category_title)
+            current_category = category_title
+        lines.append(f'  {option_name}: {cakes_count}')
+    return '\n'.join(lines)
@@ -0,0 +1,128 @@
+import cProfile
+import json
+import logging
+import threading
+import time
+
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.db import connection
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.utils.request import Request
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class ProfilingRequest(Request):
+    # Запоминает вызовы Bot API, сделанные при обработке
+    # профилируемого апдейта в текущем потоке
+    def post(self, url, data, timeout=None):
+        records = getattr(_local, 'records', None)
+        if records is None:
+            return super().post(url, data, timeout=timeout)
+        started_at = time.perf_counter()
+        try:
+            return super().post(url, data, timeout=timeout)
+        finally:
+            records['telegram_calls'].append({
+                'method': url.rsplit('/', 1)[-1],
+                'duration_ms': (time.perf_counter() - started_at) * 1000,
+            })
+
+
+def get_state_name(state):
+    return getattr(state, 'name', state)
+
+
+class SlowUpdateProfiler:
+    def __init__(self, threshold_ms, profile_dir, keep_count=100):
+        self.threshold_ms = threshold_ms
+        self.profile_dir = Path(profile_dir)
+        self.keep_count = keep_count
+        self.conversation_handler = None
+
+    def register(self, dispatcher, conversation_handler):
+        # Замер начинается раньше всех обработчиков и заканчивается после них
+        self.conversation_handler = conversation_handler
+        dispatcher.add_handler(TypeHandler(Update, self.start), group=-2)
+        dispatcher.add_handler(TypeHandler(Update, self.finish), group=1000)
+
+    def get_state(self, update):
+        if not self.conversation_handler or not update.effective_chat:
+            return None
+        key = (update.effective_chat.id, update.effective_user.id)
+        state = self.conversation_handler.conversations.get(key)
+        return get_state_name(state)
+
+    def record_sql(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            _local.records['sql'].append({
+                'sql': sql,
+                'duration_ms': (time.perf_counter() - started_at) * 1000,
+            })
+
+    def start(self, update, context):
+        self._stop_profile()
+        _local.records = {
+            'update_id': update.update_id,
+            'state_before': self.get_state(update),
+            'sql': [],
+            'telegram_calls': [],
+        }
+        _local.exit_stack = ExitStack()
+        _local.exit_stack.enter_context(
+            connection.execute_wrapper(self.record_sql)
+        )
+        _local.profile = cProfile.Profile()
+        _local.started_at = time.perf_counter()
+        _local.profile.enable()
+
+    def finish(self, update, context):
+        if getattr(_local, 'profile', None) is None:
+            return
+        duration_ms = (time.perf_counter() - _local.started_at) * 1000
+        profile = _local.profile
+        records = _local.records
+        self._stop_profile()
+
+        if duration_ms < self.threshold_ms:
+            return
+        records['duration_ms'] = duration_ms
+        records['state_after'] = self.get_state(update)
+        records['created_at'] = time.time()
+        try:
+            self.save(profile, records)
+        except OSError:
+            logger.exception('Can not save profile of update %s',
+                             records['update_id'])
+
+    def save(self, profile, records):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        file_stem = f'{int(records["created_at"] * 1000)}_{records["update_id"]}'
+        profile.dump_stats(self.profile_dir / f'{file_stem}.prof')
+        with open(self.profile_dir / f'{file_stem}.json', 'w') as file:
+            json.dump(records, file, ensure_ascii=False, indent=2)
+        logger.warning('Slow update %s took %.0f ms, profile saved as %s',
+                       records['update_id'], records['duration_ms'], file_stem)
+
+        # Храним только последние профили
+        saved_profiles = sorted(self.profile_dir.glob('*.json'))
+        for old_profile in saved_profiles[:-self.keep_count]:
+            old_profile.unlink(missing_ok=True)
+            old_profile.with_suffix('.prof').unlink(missing_ok=True)
+
+    def _stop_profile(self):
+        profile = getattr(_local, 'profile', None)
+        if profile is not None:
+            profile.disable()
+            _local.exit_stack.close()
+        _local.profile = None
+        _local.records = None
@@ -0,0 +1,70 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+
+
+_local = threading.local()
+_last_write_at = {}
+_last_write_lock = threading.Lock()
+
+
+def bind_chat(update, context):
+    # Обработчик группы диспетчера: запоминает чат, чтобы после записи
+    # чтения этого диалога какое-то время шли в основную базу
+    _local.chat_id = update.effective_chat.id if update.effective_chat else None
+
+
+def is_pinned_to_primary():
+    chat_id = getattr(_local, 'chat_id', None)
+    if chat_id is None:
+        return False
+    last_write_at = _last_write_at.get(chat_id)
+    if last_write_at is None:
+        return False
+    return time.monotonic() - last_write_at < settings.REPLICA_PIN_SECONDS
+
+
+def get_read_alias():
+    # Реплика для чтений, которые допускают небольшое отставание данных
+    if not settings.DATABASE_REPLICAS or is_pinned_to_primary():
+        return 'default'
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+def remember_write():
+    chat_id = getattr(_local, 'chat_id', None)
+    if chat_id is None:
+        return
+    now = time.monotonic()
+    with _last_write_lock:
+        _last_write_at[chat_id] = now
+        if len(_last_write_at) > 10000:
+            for stale_chat_id, written_at in list(_last_write_at.items()):
+                if now - written_at >= settings.REPLICA_PIN_SECONDS:
+                    del _last_write_at[stale_chat_id]
+
+
+class ReplicaRouter:
+    # Все запросы по умолчанию идут в основную базу, реплики используются
+    # только там, где запрос явно получил базу из get_read_alias
+    def db_for_read(self, model, **hints):
+        return None
+
+    def db_for_write(self, model, **hints):
+        remember_write()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class ReplicaChangeListMixin:
+    # Списки объектов в админке читаются с реплики
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        url_name = getattr(request.resolver_match, 'url_name', '') or ''
+        if request.method == 'GET' and url_name.endswith('_changelist'):
+            return queryset.using(get_read_alias())
+        return queryset
@@ -0,0 +1,312 @@
+import logging
+
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from bake_cake_bot.models import ArchivedCake, ArchivedCakeOption
+from bake_cake_bot.models import ArchivedOrder, CakeOption, DailyOptionSales
+from bake_cake_bot.models import DailySales, Order
+
+
+logger = logging.getLogger(__name__)
+
+
+def add_to_summary(day, orders_count, revenue, cakes_count=0,
+                   cakes_amount=0, option_counts=None):
+    # Строка дня создается пустой, а счетчики меняются через F(),
+    # поэтому одновременные подтверждения не теряют друг друга
+    DailySales.objects.bulk_create(
+        [DailySales(day=day)],
+        ignore_conflicts=True
+    )
+    DailySales.objects.filter(day=day).update(
+        orders_count=F('orders_count') + orders_count,
+        revenue=F('revenue') + revenue,
+        cakes_count=F('cakes_count') + cakes_count,
+        cakes_amount=F('cakes_amount') + cakes_amount,
+    )
+    if not option_counts:
+        return
+
+    DailyOptionSales.objects.bulk_create(
+        [
+            DailyOptionSales(
+                day=day,
+                category_title=category_title,
+                option_name=option_name,
+            )
+            for category_title, option_name in option_counts
+        ],
+        ignore_conflicts=True
+    )
+    for (category_title, option_name), cakes_count in option_counts.items():
+        DailyOptionSales.objects.filter(
+            day=day,
+            category_title=category_title,
+            option_name=option_name,
+        ).update(cakes_count=F('cakes_count') + cakes_count)
+
+
+def get_order_cakes_sales(order_id):
+    cakes = (
+        Order.cakes.through.objects
+        .filter(order_id=order_id)
+        .aggregate(cakes_count=Count('id'), cakes_amount=Sum('cake__price'))
+    )
+    option_counts = {
+        (category_title, option_name): cakes_count
+        for category_title, option_name, cakes_count in (
+            CakeOption.objects
+            .filter(cake__in_orders__id=order_id)
+            .values_list('option__category__title', 'option__name')
+            .annotate(cakes_count=Count('id'))
+            .order_by()
+        )
+    }
+    return cakes['cakes_count'], cakes['cakes_amount'] or 0, option_counts
+
+
+def get_order_sales(order_id, status, total_amount, created_at):
+    # Вклад заказа в сводки или None, если заказ не подтвержден
+    if not order_id or (status or 0) < 1:
+        return None
+    cakes_count, cakes_amount, option_counts = get_order_cakes_sales(
+        order_id
+    )
+    return (
+        timezone.localdate(created_at),
+        total_amount or 0,
+        cakes_count,
+        cakes_amount,
+        option_counts,
+    )
+
+
+def apply_order_sales(order_sales, sign):
+    if order_sales is None:
+        return
+    day, revenue, cakes_count, cakes_amount, option_counts = order_sales
+    add_to_summary(
+        day,
+        orders_count=sign,
+        revenue=sign * revenue,
+        cakes_count=sign * cakes_count,
+        cakes_amount=sign * cakes_amount,
+        option_counts={
+            option: sign * cakes_count
+            for option, cakes_count in option_counts.items()
+        },
+    )
+
+
+def track_order_sales(sender, instance, **kwargs):
+    # Вызывается внутри транзакции Order.save, до запоминания
+    # загруженных значений, поэтому видны и старые, и новые.
+    # Заказ из формы админки учитывается в OrderAdmin.save_related,
+    # когда его торты уже сохранены
+    if getattr(instance, '_track_related_later', False):
+        return
+    loaded_status = getattr(instance, '_loaded_status', None)
+    was_confirmed = (loaded_status or 0) >= 1
+    loaded_total_amount = getattr(instance, '_loaded_total_amount', None) or 0
+
+    if was_confirmed == instance.is_confirmed():
+        if was_confirmed and instance.total_amount != loaded_total_amount:
+            add_to_summary(
+                timezone.localdate(instance.created_at),
+                orders_count=0,
+                revenue=instance.total_amount - loaded_total_amount,
+            )
+        return
+
+    if instance.is_confirmed():
+        apply_order_sales(
+            get_order_sales(
+                instance.id,
+                instance.status,
+                instance.total_amount,
+                instance.created_at
+            ),
+            1
+        )
+    else:
+        apply_order_sales(
+            get_order_sales(
+                instance.id,
+                loaded_status,
+                loaded_total_amount,
+                instance.created_at
+            ),
+            -1
+        )
+
+
+def track_order_sales_delete(sender, instance, **kwargs):
+    # При переносе в архив заказ удаляется, но из сводок не уходит:
+    # архивные заказы в них тоже учитываются
+    if ArchivedOrder.objects.filter(id=instance.id).exists():
+        return
+    apply_order_sales(
+        get_order_sales(
+            instance.id,
+            getattr(instance, '_loaded_status', instance.status),
+            getattr(instance, '_loaded_total_amount', instance.total_amount),
+            instance.created_at
+        ),
+        -1
+    )
+
+
+def get_id_batches(queryset, batch_size):
+    last_id = 0
+    while True:
+        ids = list(
+            queryset
+            .filter(id__gt=last_id)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def collect_sales(days, options, orders, cakes, cake_options):
+    for row in orders.values('day').annotate(
+        orders_count=Count('id'),
+        revenue=Sum('total_amount'),
+    ).order_by():
+        days[row['day']][0] += row['orders_count']
+        days[row['day']][1] += row['revenue'] or 0
+    for row in cakes.values('day').annotate(
+        cakes_count=Count('id'),
+        cakes_amount=Sum('price'),
+    ).order_by():
+        days[row['day']][2] += row['cakes_count']
+        days[row['day']][3] += row['cakes_amount'] or 0
+    for row in cake_options.values(
+        'day', 'category_title', 'option_name'
+    ).annotate(cakes_count=Count('id')).order_by():
+        options[
+            (row['day'], row['category_title'], row['option_name'])
+        ] += row['cakes_count']
+
+
+def rebuild_sales(batch_size=5000):
+    # История читается пачками по id заказов, в памяти копятся только
+    # итоги по дням и параметрам, а таблицы сводок заменяются целиком
+    days = defaultdict(lambda: [0, 0, 0, 0])
+    options = Counter()
+    orders_total = 0
+
+    confirmed_orders = Order.objects.filter(status__gte=1)
+    for order_ids in get_id_batches(confirmed_orders, batch_size):
+        collect_sales(
+            days,
+            options,
+            Order.objects
+            .filter(id__in=order_ids)
+            .annotate(day=TruncDate('created_at')),
+            Order.cakes.through.objects
+            .filter(order_id__in=order_ids)
+            .annotate(
+                day=TruncDate('order__created_at'),
+                price=F('cake__price'),
+            ),
+            CakeOption.objects
+            .filter(cake__in_orders__id__in=order_ids)
+            .annotate(
+                day=TruncDate('cake__in_orders__created_at'),
+                category_title=F('option__category__title'),
+                option_name=F('option__name'),
+            ),
+        )
+        orders_total += len(order_ids)
+
+    for order_ids in get_id_batches(ArchivedOrder.objects.all(), batch_size):
+        collect_sales(
+            days,
+            options,
+            ArchivedOrder.objects
+            .filter(id__in=order_ids)
+            .annotate(day=TruncDate('created_at')),
+            ArchivedCake.objects
+            .filter(order_id__in=order_ids)
+            .annotate(day=TruncDate('order__created_at')),
+            ArchivedCakeOption.objects
+            .filter(cake__order_id__in=order_ids)
+            .annotate(day=TruncDate('cake__order__created_at')),
+        )
+        orders_total += len(order_ids)
+
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        DailyOptionSales.objects.all().delete()
+        DailySales.objects.bulk_create(
+            [
+                DailySales(
+                    day=day,
+                    orders_count=orders_count,
+                    revenue=revenue,
+                    cakes_count=cakes_count,
+                    cakes_amount=cakes_amount,
+                )
+                for day, (orders_count, revenue, cakes_count, cakes_amount)
+                in days.items()
+            ],
+            batch_size=batch_size
+        )
+        DailyOptionSales.objects.bulk_create(
+            [
+                DailyOptionSales(
+                    day=day,
+                    category_title=category_title,
+                    option_name=option_name,
+                    cakes_count=cakes_count,
+                )
+                for (day, category_title, option_name), cakes_count
+                in options.items()
+            ],
+            batch_size=batch_size
+        )
+    logger.info(
+        'Rebuilt sales summary of %s days from %s orders',
+        len(days),
+        orders_total
+    )
+    return len(days), orders_total
+
+
+def get_sales_dashboard(since):
+    # Читаются только сводки: не больше строки на день и на параметр
+    days = list(DailySales.objects.filter(day__gte=since).order_by('day'))
+    option_sales = DailyOptionSales.objects.filter(day__gte=since)
+    orders_count = sum(day.orders_count for day in days)
+    cakes_count = sum(day.cakes_count for day in days)
+    cakes_amount = sum(day.cakes_amount for day in days)
+    return {
+        'days': days,
+        'orders_count': orders_count,
+        'revenue': sum(day.revenue for day in days),
+        'cakes_count': cakes_count,
+        'average_cake_price': (
+            round(cakes_amount / cakes_count) if cakes_count else 0
+        ),
+        'top_options': list(
+            option_sales
+            .values('category_title', 'option_name')
+            .annotate(cakes=Sum('cakes_count'))
+            .order_by('-cakes')[:10]
+        ),
+        'top_categories': list(
+            option_sales
+            .values('category_title')
+            .annotate(cakes=Sum('cakes_count'))
+            .order_by('-cakes')
+        ),
+    }
@@ -0,0 +1,160 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from collections import deque
+
+from telegram.ext import DispatcherHandlerStop
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def is_scheduler_worker():
+    return getattr(_local, 'is_worker', False)
+
+
+class PriorityUpdateScheduler:
+    # Апдейты разных чатов обрабатываются параллельно в порядке приоритета
+    # (меньше - важнее), апдейты одного чата - строго по очереди
+    def __init__(self, process_update, get_priority, workers=4,
+                 max_queue_size=1000, on_overload=None):
+        self.process_update = process_update
+        self.get_priority = get_priority
+        self.max_queue_size = max_queue_size
+        self.on_overload = on_overload
+
+        self.queued_count = 0
+        self.processed_count = 0
+        self.shed_count = 0
+
+        self._condition = threading.Condition()
+        self._ready_chats = []
+        self._pending_updates = {}
+        self._busy_chats = set()
+        self._sequence = itertools.count()
+        self._is_stopped = False
+        self._workers = [
+            threading.Thread(
+                target=self._work,
+                name=f'UpdateScheduler_{number}',
+                daemon=True,
+            )
+            for number in range(workers)
+        ]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self, timeout=None):
+        # Апдейты из очереди уже подтверждены Телеграму смещением
+        # getUpdates и повторно не придут, поэтому сначала воркеры
+        # разбирают очередь, но не дольше timeout секунд
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self.queued_count:
+                if deadline is None:
+                    self._condition.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning('Stop with %s unprocessed updates',
+                                   self.queued_count)
+                    break
+                self._condition.wait(remaining)
+            self._is_stopped = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def schedule(self, update, context):
+        # Обработчик первой группы диспетчера: забирает апдейт себе
+        # и останавливает его обработку в потоке диспетчера
+        if is_scheduler_worker() or not update.effective_chat:
+            return
+        self.submit(update.effective_chat.id, update)
+        raise DispatcherHandlerStop()
+
+    def submit(self, chat_id, update):
+        with self._condition:
+            is_shed = (self.queued_count >= self.max_queue_size
+                       and self.get_priority(update) > 0)
+            if is_shed:
+                self.shed_count += 1
+                logger.warning('Update queue is full, shed update %s',
+                               update.update_id)
+            else:
+                # Важные апдейты ждут освобождения места в очереди
+                while (self.queued_count >= self.max_queue_size
+                       and not self._is_stopped):
+                    self._condition.wait()
+
+                chat_updates = self._pending_updates.setdefault(
+                    chat_id,
+                    deque()
+                )
+                chat_updates.append(update)
+                self.queued_count += 1
+                if len(chat_updates) == 1 and chat_id not in self._busy_chats:
+                    self._mark_chat_ready(chat_id)
+                self._condition.notify_all()
+
+        if is_shed:
+            # Уже без блокировки: ответ клиенту идет через сеть, и все это
+            # время воркеры и другие апдейты не должны ждать
+            if self.on_overload:
+                self.on_overload(update)
+            return False
+        return True
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                'queued': self.queued_count,
+                'processed': self.processed_count,
+                'shed': self.shed_count,
+                'busy_chats': len(self._busy_chats),
+            }
+
+    def _mark_chat_ready(self, chat_id):
+        # Приоритет считается по первому апдейту чата в момент, когда чат
+        # готов к обработке, т.е. по актуальному состоянию диалога
+        next_update = self._pending_updates[chat_id][0]
+        heapq.heappush(
+            self._ready_chats,
+            (self.get_priority(next_update), next(self._sequence), chat_id),
+        )
+
+    def _work(self):
+        _local.is_worker = True
+        while True:
+            with self._condition:
+                while not self._ready_chats and not self._is_stopped:
+                    self._condition.wait()
+                if self._is_stopped:
+                    return
+                _, _, chat_id = heapq.heappop(self._ready_chats)
+                update = self._pending_updates[chat_id].popleft()
+                self.queued_count -= 1
+                self._busy_chats.add(chat_id)
+                self._condition.notify_all()
+
+            try:
+                self.process_update(update)
+            except Exception:
+                logger.exception('Error while processing update %s',
+                                 update.update_id)
+            finally:
+                with self._condition:
+                    self.processed_count += 1
+                    self._busy_chats.discard(chat_id)
+                    if self._pending_updates[chat_id]:
+                        self._mark_chat_ready(chat_id)
+                    else:
+                        del self._pending_updates[chat_id]
+                    self._condition.notify_all()
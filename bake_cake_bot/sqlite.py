@@ -0,0 +1,30 @@
+import threading
+
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+
+
+_write_lock = threading.RLock()
+
+
+def tune_sqlite(sender, connection, **kwargs):
+    # Настройки применяются к каждому новому соединению с SQLite
+    if connection.vendor != 'sqlite' or not settings.SQLITE_TUNING:
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+def serialized_write(func):
+    # SQLite допускает только одного писателя. Потоки бота пишут по очереди
+    # внутри процесса, а не ждут друг друга на блокировке базы
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if connection.vendor != 'sqlite':
+            return func(*args, **kwargs)
+        with _write_lock:
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,168 @@
+import heapq
+
+from bisect import bisect_right
+from itertools import accumulate, count
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from bake_cake_bot.models import CakeOption
+
+
+POPULARITY_CACHE_KEY = 'option_popularity'
+
+
+def get_option_popularity():
+    # Популярность параметра - сколько раз его выбирали в тортах
+    popularity = cache.get(POPULARITY_CACHE_KEY)
+    if popularity is None:
+        popularity = dict(
+            CakeOption.objects
+            .values_list('option_id')
+            .annotate(cakes_count=Count('id'))
+        )
+        cache.set(
+            POPULARITY_CACHE_KEY,
+            popularity,
+            timeout=settings.OPTION_POPULARITY_CACHE_SECONDS
+        )
+    return popularity
+
+
+class BudgetSuggester:
+    # Поиск с отсечениями по категориям в порядке выбора.
+    # categories: последовательность (is_mandatory, [(option_id, price, score)])
+    def __init__(self, categories):
+        self.choices = []
+        self.prices = []
+        self.best_scores = []
+        min_prices = []
+        max_scores = []
+        for is_mandatory, options in categories:
+            choices = [
+                (price, score, option_id)
+                for option_id, price, score in options
+            ]
+            if not is_mandatory:
+                # Пропуск категории - вариант с нулевой ценой
+                choices.append((0, 0, None))
+            choices.sort(key=lambda choice: (choice[0], -choice[1]))
+
+            prices = [price for price, score, option_id in choices]
+            self.prices.append(prices)
+            # Лучшая популярность среди вариантов не дороже i-го
+            self.best_scores.append(list(accumulate(
+                (score for price, score, option_id in choices),
+                max
+            )))
+            # Перебираем сначала популярные, чтобы быстрее поднять порог
+            self.choices.append(sorted(
+                choices,
+                key=lambda choice: (-choice[1], choice[0])
+            ))
+            min_prices.append(prices[0] if prices else None)
+            max_scores.append(max(
+                (score for price, score, option_id in choices),
+                default=0
+            ))
+
+        self.is_empty = None in min_prices
+        categories_count = len(self.choices)
+        self.min_rest_price = [0] * (categories_count + 1)
+        self.max_rest_score = [0] * (categories_count + 1)
+        if not self.is_empty:
+            for index in reversed(range(categories_count)):
+                self.min_rest_price[index] = (
+                    self.min_rest_price[index + 1] + min_prices[index]
+                )
+                self.max_rest_score[index] = (
+                    self.max_rest_score[index + 1] + max_scores[index]
+                )
+
+    @property
+    def min_price(self):
+        return None if self.is_empty else self.min_rest_price[0]
+
+    def get_score_bound(self, index, budget_left):
+        # Верхняя оценка: каждой оставшейся категории отдаем весь остаток
+        bound = 0
+        for category_index in range(index, len(self.choices)):
+            affordable = bisect_right(
+                self.prices[category_index],
+                budget_left
+                - self.min_rest_price[index]
+                + self.prices[category_index][0]
+            )
+            if not affordable:
+                return None
+            bound += self.best_scores[category_index][affordable - 1]
+        return bound
+
+    def suggest(self, budget, limit=5):
+        if self.is_empty or self.min_rest_price[0] > budget:
+            return []
+
+        best = []
+        sequence = count()
+        chosen = []
+        categories_count = len(self.choices)
+
+        def get_threshold():
+            if len(best) < limit:
+                return -1
+            return best[0][0]
+
+        def search(index, price, score):
+            if index == categories_count:
+                item = (score, -price, next(sequence), list(chosen))
+                if len(best) < limit:
+                    heapq.heappush(best, item)
+                else:
+                    heapq.heappushpop(best, item)
+                return
+
+            budget_left = budget - price
+            if score + self.max_rest_score[index] <= get_threshold():
+                return
+            bound = self.get_score_bound(index, budget_left)
+            if bound is None or score + bound <= get_threshold():
+                return
+
+            price_limit = budget_left - self.min_rest_price[index + 1]
+            for choice_price, choice_score, option_id in self.choices[index]:
+                if choice_price > price_limit:
+                    continue
+                if (
+                    score + choice_score + self.max_rest_score[index + 1]
+                    <= get_threshold()
+                ):
+                    # Варианты отсортированы по убыванию популярности
+                    break
+                chosen.append((option_id, choice_price))
+                search(index + 1, price + choice_price, score + choice_score)
+                chosen.pop()
+
+        search(0, 0, 0)
+
+        suggestions = []
+        for score, negative_price, _, combination in sorted(best, reverse=True):
+            suggestions.append((
+                -negative_price,
+                score,
+                [option_id for option_id, price in combination if option_id],
+            ))
+        return suggestions
+
+
+def build_suggester(catalog, popularity):
+    return BudgetSuggester([
+        (
+            category.is_mandatory,
+            [
+                (option.id, option.price, popularity.get(option.id, 0))
+                for option in category.options.all()
+            ],
+        )
+        for category in catalog.categories
+    ])
@@ -0,0 +1,78 @@
+import logging
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from bake_cake_bot.models import Cake, Order
+from bake_cake_bot.sqlite import serialized_write
+
+
+logger = logging.getLogger(__name__)
+
+
+@serialized_write
+def delete_draft_cakes(cake_ids):
+    with transaction.atomic():
+        Cake.objects.filter(id__in=cake_ids, is_in_order=False).delete()
+
+
+def sweep_draft_cakes(max_age, batch_size=500):
+    # Удаляем черновики пачками: каждая пачка в своей короткой транзакции,
+    # чтобы не держать блокировку на всю таблицу. В боте пачки пишутся
+    # по очереди с его потоками, но не занимают очередь на всю очистку
+    cutoff = timezone.now() - max_age
+    deleted_total = 0
+    while True:
+        cake_ids = list(
+            Cake.objects
+            .filter(is_in_order=False, created_at__lt=cutoff)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not cake_ids:
+            break
+        delete_draft_cakes(cake_ids)
+        deleted_total += len(cake_ids)
+    return deleted_total
+
+
+@serialized_write
+def delete_draft_orders(order_ids):
+    # Неподтвержденные заказы удаляются вместе со своими тортами,
+    # забронированные ими слоты доставки освобождает pre_delete заказа.
+    # Успевшие подтвердиться заказы не удаляются
+    with transaction.atomic():
+        Cake.objects.filter(
+            in_orders__id__in=order_ids,
+            in_orders__status=0,
+        ).delete()
+        Order.objects.filter(id__in=order_ids, status=0).delete()
+
+
+def sweep_draft_orders(max_age, batch_size=500):
+    cutoff = timezone.now() - max_age
+    deleted_total = 0
+    while True:
+        order_ids = list(
+            Order.objects
+            .filter(status=0, created_at__lt=cutoff)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            break
+        delete_draft_orders(order_ids)
+        deleted_total += len(order_ids)
+    return deleted_total
+
+
+def sweep_drafts(max_age_hours, batch_size=500):
+    max_age = timedelta(hours=max_age_hours)
+    orders_count = sweep_draft_orders(max_age, batch_size)
+    cakes_count = sweep_draft_cakes(max_age, batch_size)
+    logger.info(
+        'Swept %s draft orders and %s draft cakes', orders_count, cakes_count
+    )
+    return orders_count, cakes_count
@@ -1,3 +1,366 @@
-from django.test import TestCase
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from telegram.ext import DispatcherHandlerStop
+
+from bake_cake_bot import idempotency
+
+from bake_cake_bot.delivery import book_order_slot, reserve_slot
+from bake_cake_bot.management.commands import runbot
+from bake_cake_bot.management.commands.rebuildclientstats import (
+    rebuild_client_stats,
+)
+from bake_cake_bot.idempotency import UpdateDeduplicator, run_once
+from bake_cake_bot.models import ArchivedOrder, Client, DeliverySlot, Order
+from bake_cake_bot.models import ProcessedAction, ProcessedUpdate
+from bake_cake_bot.scheduling import PriorityUpdateScheduler
+from bake_cake_bot.sweeper import sweep_draft_orders
+
+
+class LastOrderAtTests(TestCase):
+    def setUp(self):
+        self.client_entry = Client.objects.create(
+            tg_chat_id=1,
+            first_name='Тест',
+        )
+        self.now = timezone.now()
+
+    def create_order(self, days_ago, status):
+        # Дата создания сдвигается до подтверждения, как у заказа,
+        # который подтвердили позже
+        order = Order.objects.create(client=self.client_entry)
+        created_at = self.now - timedelta(days=days_ago)
+        Order.objects.filter(id=order.id).update(created_at=created_at)
+        order.refresh_from_db()
+        if status:
+            order.status = status
+            order.save()
+        return order
+
+    def create_archived_order(self, days_ago):
+        created_at = self.now - timedelta(days=days_ago)
+        return ArchivedOrder.objects.create(
+            id=10 ** 6,
+            client=self.client_entry,
+            total_amount=100,
+            created_at=created_at,
+            modified_at=created_at,
+        )
+
+    def get_last_order_at(self):
+        self.client_entry.refresh_from_db()
+        return self.client_entry.last_order_at
+
+    def test_rebuild_prefers_newer_archived_order(self):
+        # Давний заказ застрял в работе, а более новый уже в архиве
+        self.create_order(days_ago=200, status=2)
+        archived_order = self.create_archived_order(days_ago=100)
+
+        rebuild_client_stats()
+
+        self.assertEqual(self.get_last_order_at(), archived_order.created_at)
+
+    def test_rebuild_with_archive_only(self):
+        archived_order = self.create_archived_order(days_ago=100)
+
+        rebuild_client_stats()
+
+        self.assertEqual(self.get_last_order_at(), archived_order.created_at)
+
+    def test_rebuild_without_orders(self):
+        self.create_order(days_ago=10, status=0)
+
+        rebuild_client_stats()
+
+        self.assertIsNone(self.get_last_order_at())
+
+    def test_confirm_keeps_newer_date(self):
+        new_order = self.create_order(days_ago=10, status=1)
+        old_order = self.create_order(days_ago=200, status=0)
+
+        old_order.status = 1
+        old_order.save()
+
+        self.assertEqual(self.get_last_order_at(), new_order.created_at)
+
+    def test_unconfirm_falls_back_to_newest_remaining(self):
+        stuck_order = self.create_order(days_ago=200, status=2)
+        archived_order = self.create_archived_order(days_ago=100)
+        order = self.create_order(days_ago=10, status=1)
+
+        order.status = 0
+        order.save()
+
+        self.assertEqual(self.get_last_order_at(), archived_order.created_at)
+        self.assertLess(stuck_order.created_at, archived_order.created_at)
+
+
+class DeliverySlotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_entry = Client.objects.create(
+            tg_chat_id=2,
+            first_name='Тест',
+        )
+        self.slot = self.create_slot(hours=24, capacity=3)
+        self.other_slot = self.create_slot(hours=27, capacity=3)
+
+    def create_slot(self, hours, capacity):
+        starts_at = timezone.now() + timedelta(hours=hours)
+        return DeliverySlot.objects.create(
+            starts_at=starts_at,
+            ends_at=starts_at + timedelta(hours=2),
+            capacity=capacity,
+        )
+
+    def create_booked_order(self, slot):
+        order = Order.objects.create(client=self.client_entry)
+        self.assertIsNotNone(book_order_slot(order.id, slot.id))
+        order.refresh_from_db()
+        return order
+
+    def get_reserved(self, slot):
+        slot.refresh_from_db()
+        return slot.reserved
+
+    def test_reserve_slot_never_exceeds_capacity(self):
+        results = [reserve_slot(self.slot.id) for _ in range(5)]
+
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertEqual(self.get_reserved(self.slot), 3)
+
+    def test_full_slot_is_not_booked(self):
+        for _ in range(3):
+            self.create_booked_order(self.slot)
+        order = Order.objects.create(client=self.client_entry)
+
+        self.assertIsNone(book_order_slot(order.id, self.slot.id))
+        self.assertEqual(self.get_reserved(self.slot), 3)
+
+    def test_rebooking_moves_seat(self):
+        order = self.create_booked_order(self.slot)
+
+        book_order_slot(order.id, self.other_slot.id)
+        book_order_slot(order.id, self.other_slot.id)
+
+        order.refresh_from_db()
+        self.assertEqual(order.delivery_slot_id, self.other_slot.id)
+        self.assertEqual(self.get_reserved(self.slot), 0)
+        self.assertEqual(self.get_reserved(self.other_slot), 1)
+
+    def test_deleting_order_releases_seat_once(self):
+        # Остальные места в слоте заняты, лишнее освобождение их заденет
+        self.create_booked_order(self.slot)
+        self.create_booked_order(self.slot)
+        order = self.create_booked_order(self.slot)
+
+        order.delete()
+
+        self.assertEqual(self.get_reserved(self.slot), 2)
+
+    def test_sweeping_draft_orders_releases_seats_once(self):
+        self.create_booked_order(self.slot)
+        old_orders = [
+            self.create_booked_order(self.slot),
+            self.create_booked_order(self.slot),
+        ]
+        Order.objects.filter(id__in=[order.id for order in old_orders]).update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+
+        sweep_draft_orders(timedelta(hours=24))
+
+        self.assertEqual(self.get_reserved(self.slot), 1)
+
+    def test_confirm_with_passed_slot_asks_for_another(self):
+        order = self.create_booked_order(self.slot)
+        DeliverySlot.objects.filter(id=self.slot.id).update(
+            starts_at=timezone.now() - timedelta(minutes=5)
+        )
+        update = SimpleNamespace(message=SimpleNamespace(
+            chat_id=self.client_entry.tg_chat_id,
+            reply_text=lambda *args, **kwargs: None,
+        ))
+        context = SimpleNamespace(user_data={'order_id': order.id})
+
+        state = runbot.handle_confirm_order(update, context)
+
+        order.refresh_from_db()
+        self.assertEqual(state, runbot.States.CHOOSE_DELIVERY_SLOT)
+        self.assertIsNone(order.delivery_slot_id)
+        self.assertEqual(order.status, 0)
+
+
+class RepeatOrderTests(TestCase):
+    def setUp(self):
+        self.client_entry = Client.objects.create(
+            tg_chat_id=4,
+            first_name='Тест',
+        )
+        self.other_client = Client.objects.create(
+            tg_chat_id=5,
+            first_name='Тест',
+        )
+        self.replies = []
+
+    def make_update(self, chat_id, order_id):
+        return SimpleNamespace(message=SimpleNamespace(
+            chat_id=chat_id,
+            text=f'Повторить заказ №{order_id}',
+            reply_text=lambda *args, **kwargs: self.replies.append(args),
+        ))
+
+    def test_other_client_order_is_not_repeated(self):
+        order = Order.objects.create(client=self.other_client, status=1)
+        update = self.make_update(self.client_entry.tg_chat_id, order.id)
+        context = SimpleNamespace(user_data={})
+
+        state = runbot.handle_repeat_order(update, context)
+
+        self.assertEqual(state, runbot.States.ORDER_DETAILS)
+        self.assertNotIn('order_id', context.user_data)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(len(self.replies), 1)
+
+
+class RunOnceTests(TestCase):
+    def setUp(self):
+        # Перезапуск бота: память о недавних действиях пуста
+        self.addCleanup(
+            setattr,
+            idempotency,
+            '_recent_actions',
+            idempotency._recent_actions
+        )
+        idempotency._recent_actions = idempotency.RecentKeys(100)
+        self.client_entry = Client.objects.create(
+            tg_chat_id=3,
+            first_name='Тест',
+        )
+        self.action_calls = 0
+
+    def create_order(self):
+        self.action_calls += 1
+        return Order.objects.create(client=self.client_entry).id
+
+    def test_repeated_key_returns_same_order(self):
+        order_id = run_once('checkout:3:1', self.create_order)
+
+        self.assertEqual(run_once('checkout:3:1', self.create_order), order_id)
+        self.assertEqual(self.action_calls, 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_repeated_key_after_restart_returns_same_order(self):
+        order_id = run_once('checkout:3:1', self.create_order)
+        idempotency._recent_actions = idempotency.RecentKeys(100)
+
+        self.assertEqual(run_once('checkout:3:1', self.create_order), order_id)
+        self.assertEqual(self.action_calls, 1)
+
+    def test_concurrent_action_returns_stored_result(self):
+        # Параллельный поток записал ключ уже после нашей проверки
+        ProcessedAction.objects.create(key='checkout:3:1', result=42)
+        filter_actions = ProcessedAction.objects.filter
+        filter_calls = []
+
+        def filter_after_first_check(*args, **kwargs):
+            filter_calls.append(kwargs)
+            if len(filter_calls) == 1:
+                return ProcessedAction.objects.none()
+            return filter_actions(*args, **kwargs)
+
+        with mock.patch.object(
+            ProcessedAction.objects,
+            'filter',
+            side_effect=filter_after_first_check,
+        ):
+            result = run_once('checkout:3:1', self.create_order)
+
+        self.assertEqual(result, 42)
+        self.assertEqual(self.action_calls, 0)
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_different_keys_run_separately(self):
+        first_order_id = run_once('checkout:3:1', self.create_order)
+        second_order_id = run_once('checkout:3:2', self.create_order)
+
+        self.assertNotEqual(first_order_id, second_order_id)
+        self.assertEqual(self.action_calls, 2)
+
+
+class UpdateDeduplicatorTests(TestCase):
+    def create_deduplicator(self):
+        return UpdateDeduplicator(max_size=100, retention=timedelta(hours=48))
+
+    def make_update(self, update_id):
+        return SimpleNamespace(update_id=update_id)
+
+    def assert_duplicate(self, deduplicator, update_id):
+        with self.assertRaises(DispatcherHandlerStop):
+            deduplicator.check_update(self.make_update(update_id), None)
+
+    def test_repeated_update_is_dropped(self):
+        deduplicator = self.create_deduplicator()
+
+        deduplicator.check_update(self.make_update(1), None)
+
+        self.assert_duplicate(deduplicator, 1)
+        self.assertEqual(deduplicator.duplicates_count, 1)
+
+    def test_loaded_updates_are_dropped_after_restart(self):
+        ProcessedUpdate.objects.create(update_id=1)
+        ProcessedUpdate.objects.create(
+            update_id=2,
+            processed_at=timezone.now() - timedelta(hours=72),
+        )
+        deduplicator = self.create_deduplicator()
+
+        deduplicator.load()
+
+        self.assert_duplicate(deduplicator, 1)
+        # Запись старше срока хранения не загружается
+        deduplicator.check_update(self.make_update(2), None)
+        deduplicator.check_update(self.make_update(3), None)
+
+    def test_flushed_updates_are_dropped_after_restart(self):
+        deduplicator = self.create_deduplicator()
+        update = self.make_update(5)
+        deduplicator.check_update(update, None)
+        deduplicator.mark_processed(update, None)
+        deduplicator.flush()
+
+        restarted_deduplicator = self.create_deduplicator()
+        restarted_deduplicator.load()
+
+        self.assert_duplicate(restarted_deduplicator, 5)
+
+
+class PriorityUpdateSchedulerTests(SimpleTestCase):
+    def test_stop_processes_queued_updates(self):
+        processed_ids = []
+        scheduler = PriorityUpdateScheduler(
+            lambda update: processed_ids.append(update.update_id),
+            lambda update: 0,
+            workers=2,
+        )
+        for update_id in range(20):
+            scheduler.submit(
+                update_id % 3,
+                SimpleNamespace(update_id=update_id)
+            )
+
+        scheduler.start()
+        scheduler.stop(timeout=5)
+
+        self.assertEqual(sorted(processed_ids), list(range(20)))
+        # Апдейты одного чата обрабатываются по порядку
+        for chat_id in range(3):
+            chat_update_ids = [
+                update_id for update_id in processed_ids
+                if update_id % 3 == chat_id
+            ]
+            self.assertEqual(chat_update_ids, sorted(chat_update_ids))
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+
+from telegram.ext import DispatcherHandlerStop
+
+from bake_cake_bot.scheduling import is_scheduler_worker
+
+
+logger = logging.getLogger(__name__)
+
+
+class ChatThrottle:
+    # Ограничение частоты апдейтов одного чата по алгоритму token bucket.
+    # Повторное нажатие той же кнопки в пределах окна отбрасывается сразу
+    def __init__(self, rate, burst, duplicate_window=0.5, idle_timeout=600):
+        self.rate = rate
+        self.burst = burst
+        self.duplicate_window = duplicate_window
+        self.idle_timeout = idle_timeout
+
+        self.allowed_count = 0
+        self.throttled_count = 0
+        self.duplicates_count = 0
+
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._last_cleanup_at = time.monotonic()
+
+    def is_allowed(self, chat_id, text=None):
+        now = time.monotonic()
+        with self._lock:
+            self._cleanup(now)
+            tokens, updated_at, last_text, last_text_at = self._buckets.get(
+                chat_id,
+                (self.burst, now, None, None),
+            )
+            if (text is not None and text == last_text
+                    and now - last_text_at < self.duplicate_window):
+                self.duplicates_count += 1
+                return False
+
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                self._buckets[chat_id] = (tokens, now, last_text, last_text_at)
+                self.throttled_count += 1
+                return False
+
+            self._buckets[chat_id] = (tokens - 1, now, text, now)
+            self.allowed_count += 1
+            return True
+
+    def check_update(self, update, context):
+        # Обработчик группы диспетчера, который идет раньше всех остальных.
+        # В потоках планировщика апдейт уже прошел проверку
+        if is_scheduler_worker() or not update.effective_chat:
+            return
+        text = update.message.text if update.message else None
+        if not self.is_allowed(update.effective_chat.id, text):
+            logger.debug('Drop update %s of chat %s',
+                         update.update_id, update.effective_chat.id)
+            raise DispatcherHandlerStop()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'allowed': self.allowed_count,
+                'throttled': self.throttled_count,
+                'duplicates': self.duplicates_count,
+                'tracked_chats': len(self._buckets),
+            }
+
+    def _cleanup(self, now):
+        # Забываем чаты, которые давно ничего не присылали
+        if now - self._last_cleanup_at < self.idle_timeout:
+            return
+        self._buckets = {
+            chat_id: bucket for chat_id, bucket in self._buckets.items()
+            if now - bucket[1] < self.idle_timeout
+        }
+        self._last_cleanup_at = now
+
+
+class RateLimiter:
+    # Общий для всех потоков лимит: не больше rate вызовов в секунду,
+    # вызовы распределяются равномерно, без пачек
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._lock = threading.Lock()
+        self._next_at = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_until = max(self._next_at, now)
+            self._next_at = wait_until + self.interval
+        time.sleep(max(0, wait_until - now))
+
+    def pause(self, seconds):
+        # Телеграм попросил подождать: откладываем все следующие вызовы
+        with self._lock:
+            self._next_at = max(self._next_at, time.monotonic() + seconds)